@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Shared .bam functions for the bam_* scripts: opening with
+# decompression threads, safe index creation and splitting work across
+# processes
+# Created: 2026-10-17
+# Depends: pysam
+
+import pysam
+from concurrent.futures import ProcessPoolExecutor
+from fcntl import LOCK_EX, LOCK_UN, flock
+from os import getpid, remove, replace
+from os.path import exists
+
+REGION_SIZE = 10000000  # Contigs longer than this are split into chunks
+BAI_MAX_LENGTH = 2 ** 29 - 1  # Longer contigs need a .csi index
+
+
+def open_bam(input_bam, threads=1):
+    return pysam.AlignmentFile(input_bam, 'rb', threads=threads)
+
+
+def find_index(input_bam):
+    for index_file in (input_bam + '.bai', input_bam[:-4] + '.bai',
+                       input_bam + '.csi'):
+        if exists(index_file):
+            return index_file
+    return None
+
+
+# Build the index if it is missing. Several tools started on the same fresh
+# .bam take turns through a lock file; whoever gets it first builds the index
+# under a temporary name and renames it into place, and the rest find it
+# there once they get the lock. A .csi index is built when asked for or when
+# a contig is too long for .bai.
+
+def ensure_index(input_bam, csi=False, threads=1):
+    if find_index(input_bam):
+        return find_index(input_bam)
+    lock_file = input_bam + '.index.lock'
+    with open(lock_file, 'a') as lock_handle:
+        flock(lock_handle, LOCK_EX)
+        try:
+            if find_index(input_bam):
+                return find_index(input_bam)
+            if not csi:
+                with pysam.AlignmentFile(input_bam, 'rb') as align_handle:
+                    csi = max(align_handle.lengths, default=0) > BAI_MAX_LENGTH
+            index_file = input_bam + ('.csi' if csi else '.bai')
+            temp_file = '%s.%s.tmp' % (index_file, getpid())
+            try:
+                pysam.index(*(['-c'] if csi else []),
+                            '-@', str(threads), input_bam, temp_file)
+                replace(temp_file, index_file)
+            finally:
+                if exists(temp_file):
+                    remove(temp_file)
+            if exists(lock_file):
+                remove(lock_file)
+            return index_file
+        finally:
+            flock(lock_handle, LOCK_UN)
+
+
+# Regions covering every contig with mapped reads in the index, with long
+# contigs cut into REGION_SIZE chunks
+
+def genome_regions(input_bam, region_size=REGION_SIZE):
+    regions = []
+    with open_bam(input_bam) as align_handle:
+        for stats in align_handle.get_index_statistics():
+            if stats.mapped:
+                length = align_handle.get_reference_length(stats.contig)
+                regions += [(stats.contig, start, min(start + region_size, length))
+                            for start in range(0, length, region_size)]
+    return regions
+
+
+# Reads starting in a region, so that each read belongs to exactly one region
+# even when it overlaps the next
+
+def region_reads(align_handle, contig, start, end):
+    for aln in align_handle.fetch(contig, start, end):
+        if aln.reference_start >= start:
+            yield aln
+
+
+# Run function(input_bam, *region, *args) for every region in a process pool
+# and return the results in region order. Regions are usually (contig, start,
+# end) but can be any tuple the function takes.
+
+def map_regions(function, input_bam, regions, processes, *args):
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(function, input_bam, *region, *args)
+                   for region in regions]
+        return [future.result() for future in futures]
@@ -3,24 +3,239 @@
 # Author: Jeffrey Grover
 # Purpose: Profile read legnths in a .bam alignment file
 # Created: 2019-08-16
+# Depends: pysam, numpy
 
-import pysam
+import numpy as np
 from argparse import ArgumentParser
-from os.path import exists
-from sys import exit
+from itertools import chain, islice
+from sys import exit, stderr, stdout
+from bam_io import (REGION_SIZE, ensure_index, genome_regions, map_regions,
+                    open_bam, region_reads)
+from fastq_length_filter import parse_length_bin
+from profile_sampling import TileSample, interval_rows
+from result_cache import (DEFAULT_CACHE_DIR, ResultCache, cache_key,
+                          input_fingerprint)
 
+# Bump when the counting changes so stale cached histograms are not reused
+CACHE_VERSION = 1
+LENGTH_BATCH = 1 << 18
 
-def bam_length_profile(input_bam, min_len, max_len):
+
+def bam_length_profile(input_bam, min_len, max_len, threads=1):
     profile_dict = {}
     for length in range(min_len, max_len + 1):
         profile_dict.update({length: 0})
-    with pysam.AlignmentFile(input_bam, 'rb') as align_handle:
+    with open_bam(input_bam, threads) as align_handle:
         for aln in align_handle.fetch():  # .fetch returns only mapped reads
             if min_len <= aln.query_length <= max_len:
                 profile_dict[aln.query_length] += 1
     return profile_dict
 
 
+# Parallel mode. Each worker profiles the reads starting in one region and the
+# length histograms are summed.
+
+def region_length_counts(input_bam, contig, start, end, min_len, max_len,
+                         threads=1):
+    counts = np.zeros(max_len - min_len + 1, dtype=np.int64)
+    with open_bam(input_bam, threads) as align_handle:
+        for aln in region_reads(align_handle, contig, start, end):
+            if min_len <= aln.query_length <= max_len:
+                counts[aln.query_length - min_len] += 1
+    return counts
+
+
+def bam_length_profile_parallel(input_bam, min_len, max_len, processes,
+                                threads=1):
+    counts = sum(map_regions(region_length_counts, input_bam,
+                             genome_regions(input_bam), processes, min_len,
+                             max_len, threads),
+                 np.zeros(max_len - min_len + 1, dtype=np.int64))
+    return {length: int(count)
+            for length, count in zip(range(min_len, max_len + 1), counts)}
+
+
+# Cached mode. The histogram of every read length is counted once and stored,
+# and any --min/--max window is then a slice of it.
+
+def add_counts(total, counts):
+    if len(counts) > len(total):
+        counts = counts.copy()
+        counts[:len(total)] += total
+        return counts
+    total[:len(counts)] += counts
+    return total
+
+
+def region_all_length_counts(input_bam, contig=None, start=None, end=None,
+                             threads=1):
+    counts = np.zeros(0, dtype=np.int64)
+    with open_bam(input_bam, threads) as align_handle:
+        if contig is None:
+            reads = align_handle.fetch()
+        else:
+            reads = region_reads(align_handle, contig, start, end)
+        query_lengths = (aln.query_length for aln in reads)
+        while True:
+            batch = np.fromiter(islice(query_lengths, LENGTH_BATCH),
+                                dtype=np.int64)
+            if not len(batch):
+                break
+            counts = add_counts(counts, np.bincount(batch))
+    return counts
+
+
+def bam_all_length_counts(input_bam, processes=1, threads=1):
+    if processes > 1:
+        counts = np.zeros(0, dtype=np.int64)
+        for region_counts in map_regions(region_all_length_counts, input_bam,
+                                         genome_regions(input_bam), processes,
+                                         threads):
+            counts = add_counts(counts, region_counts)
+        return counts
+    return region_all_length_counts(input_bam, threads=threads)
+
+
+def cached_length_counts(input_bam, cache, content_hash=False, processes=1,
+                         threads=1):
+    key = cache_key('bam_readlength_profile', CACHE_VERSION,
+                    [input_fingerprint(input_bam, content_hash)])
+    entry = cache.load(key)
+    if entry is not None:
+        return entry['counts']
+    counts = bam_all_length_counts(input_bam, processes, threads)
+    cache.store(key, counts=counts)
+    return counts
+
+
+def slice_length_profile(counts, min_len, max_len):
+    return {length: int(counts[length]) if length < len(counts) else 0
+            for length in range(min_len, max_len + 1)}
+
+
+# Sampled mode. The mapped part of the genome is cut into tiles that are
+# profiled in random order, counting each read in the tile holding its start,
+# until every length's proportion is within the tolerance. Intervals are taken
+# between tiles, as reads cluster within them. Profiling every tile gives the
+# exact profile.
+
+def bam_length_profile_sampled(input_bam, min_len, max_len, tolerance,
+                               confidence=0.95, tile_size=100000, seed=None,
+                               threads=1):
+    tiles = genome_regions(input_bam, tile_size)
+    sample = TileSample(max_len - min_len + 1, len(tiles))
+    order = np.random.default_rng(seed).permutation(len(tiles))
+    with open_bam(input_bam, threads) as align_handle:
+        for tile_index in order.tolist():
+            contig, start, end = tiles[tile_index]
+            counts = np.zeros(max_len - min_len + 1, dtype=np.int64)
+            for aln in region_reads(align_handle, contig, start, end):
+                if min_len <= aln.query_length <= max_len:
+                    counts[aln.query_length - min_len] += 1
+            sample.add(counts)
+            if sample.has_converged(tolerance, confidence):
+                break
+    print('Sampled %s reads from %s of %s tiles' % (
+        sample.counts.sum(), sample.n_tiles, len(tiles)), file=stderr)
+    return sample
+
+
+def output_sampled_lengths(sample, min_len, confidence):
+    print('length', 'count', 'proportion', 'ci_low', 'ci_high', sep='\t')
+    for row in interval_rows(list(range(min_len, min_len + len(sample.counts))),
+                             sample.counts, confidence,
+                             sample.interval(confidence)):
+        print(*row, sep='\t')
+
+
+# Windowed mode. Reads are counted by start position in step-sized bins, one
+# linear pass per region, and each window of the track is a sum of consecutive
+# bins taken from their cumulative sum. Length classes are counted side by
+# side and may overlap.
+
+def region_start_bins(input_bam, contig, start, end, step, length_classes,
+                      threads=1):
+    n_bins = -(-(end - start) // step)
+    counts = np.zeros((n_bins, len(length_classes)), dtype=np.int64)
+    with open_bam(input_bam, threads) as align_handle:
+        reads = ((aln.reference_start, aln.query_length)
+                 for aln in region_reads(align_handle, contig, start, end))
+        while True:
+            batch = np.fromiter(chain.from_iterable(islice(reads, LENGTH_BATCH)),
+                                dtype=np.int64).reshape(-1, 2)
+            if not len(batch):
+                break
+            bins = (batch[:, 0] - start) // step
+            for i, (name, min_len, max_len) in enumerate(length_classes):
+                keep = (min_len <= batch[:, 1]) & (batch[:, 1] <= max_len)
+                counts[:, i] += np.bincount(bins[keep], minlength=n_bins)
+    return counts
+
+
+def window_tracks(input_bam, window, step, length_classes, processes=1,
+                  threads=1):
+    regions = genome_regions(input_bam, step * max(1, REGION_SIZE // step))
+    if processes > 1:
+        results = map_regions(region_start_bins, input_bam, regions, processes,
+                              step, length_classes, threads)
+    else:
+        results = [region_start_bins(input_bam, *region, step, length_classes,
+                                     threads)
+                   for region in regions]
+    contig_bins = {}
+    contig_lengths = {}
+    for (contig, start, end), bins in zip(regions, results):
+        contig_bins.setdefault(contig, []).append(bins)
+        contig_lengths[contig] = end
+    span = window // step
+    for contig, bins in contig_bins.items():
+        bins = np.concatenate(bins)
+        cumulative = np.concatenate((np.zeros((1, bins.shape[1]),
+                                              dtype=np.int64),
+                                     np.cumsum(bins, axis=0)))
+        first = np.arange(len(bins))
+        last = np.minimum(first + span, len(bins))
+        starts = first * step
+        ends = np.minimum(starts + window, contig_lengths[contig])
+        yield contig, starts, ends, cumulative[last] - cumulative[first]
+
+
+# Tracks are written as bedGraph without the empty windows, or as one window by
+# length class array per contig in a .npz
+
+def write_bedgraph(tracks, column, output_handle):
+    for contig, starts, ends, counts in tracks:
+        keep = np.flatnonzero(counts[:, column])
+        output_handle.write(''.join(
+            '%s\t%s\t%s\t%s\n' % (contig, start, end, count)
+            for start, end, count in zip(starts[keep].tolist(),
+                                         ends[keep].tolist(),
+                                         counts[keep, column].tolist())))
+
+
+def output_window_tracks(tracks, length_classes, output_prefix=None,
+                         npz=False, window=None, step=None):
+    tracks = list(tracks)
+    if npz:
+        np.savez_compressed(
+            output_prefix + '.npz',
+            length_class=np.array([name for name, min_len, max_len
+                                   in length_classes]),
+            window=window, step=step,
+            **{'counts/' + contig: counts
+               for contig, starts, ends, counts in tracks})
+    elif output_prefix is None:
+        write_bedgraph(tracks, 0, stdout)
+    else:
+        for i, (name, min_len, max_len) in enumerate(length_classes):
+            if len(length_classes) == 1 and name == 'all':
+                output_file = output_prefix + '.bedGraph'
+            else:
+                output_file = '%s.%s.bedGraph' % (output_prefix, name)
+            with open(output_file, 'w') as output_handle:
+                write_bedgraph(tracks, i, output_handle)
+
+
 def output_fastq_lengths(profile_dict):
     print('length', 'count', sep='\t')
     for length, count in profile_dict.items():
@@ -44,6 +259,95 @@ def get_args():
                         help='Maximum length of reads to profile',
                         type=int,
                         metavar='INT')
+    parser.add_argument('-j', '--processes',
+                        help='Worker processes, each scanning its own contigs '
+                        'or contig chunks (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-@', '--threads',
+                        help='Decompression threads for each open .bam '
+                        '(default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--csi',
+                        help='Build a .csi rather than .bai index if the .bam '
+                        'is not indexed (automatic for contigs over 512 Mb)',
+                        action='store_true')
+    parser.add_argument('--sample',
+                        help='Estimate the profile from randomly chosen genome '
+                        'tiles, stopping once every proportion is within '
+                        '--tolerance, and report confidence intervals. '
+                        'Intervals are computed between tiles, since reads '
+                        'in a tile are not independent',
+                        action='store_true')
+    parser.add_argument('--tolerance',
+                        help='Largest confidence interval half-width accepted '
+                        'for each proportion when sampling (default=0.005)',
+                        default=0.005,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--confidence',
+                        help='Confidence level of the intervals (default=0.95)',
+                        default=0.95,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--tile_size',
+                        help='Size of the genome tiles read when sampling '
+                        '(default=100000)',
+                        default=100000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--seed',
+                        help='Random seed for the order tiles are sampled in',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-w', '--window',
+                        help='Write read counts in windows of this size along '
+                        'the genome, by read start, instead of the profile',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--step',
+                        help='Distance between window starts; must divide '
+                        '--window (default=--window)',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-c', '--length_class',
+                        help='With --window, count a track for the reads of '
+                        'length MIN-MAX (or LEN) named NAME, repeatable; '
+                        'otherwise one track of the reads within --min_length '
+                        'and --max_length',
+                        action='append',
+                        metavar='NAME:MIN-MAX')
+    parser.add_argument('-o', '--output_prefix',
+                        help='With --window, write PREFIX.bedGraph, or '
+                        'PREFIX.NAME.bedGraph for each length class, rather '
+                        'than one track to stdout',
+                        metavar='PREFIX')
+    parser.add_argument('--npz',
+                        help='With --window, write the window by length class '
+                        'counts of each contig to PREFIX.npz instead',
+                        action='store_true')
+    parser.add_argument('--cache',
+                        help='Store the histogram of all read lengths on disk '
+                        'and answer later runs on the unchanged .bam, with any '
+                        'length window, from it',
+                        action='store_true')
+    parser.add_argument('--cache_dir',
+                        help='Cache directory (default=%s)' % DEFAULT_CACHE_DIR,
+                        default=DEFAULT_CACHE_DIR,
+                        metavar='DIR')
+    parser.add_argument('--cache_size',
+                        help='Size in MB the cache is trimmed to, least '
+                        'recently used first (default=2048)',
+                        default=2048,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--cache_hash',
+                        help='Identify the .bam by a hash of its contents '
+                        'rather than its path, size and modification time',
+                        action='store_true')
     return parser.parse_args()
 
 # Main function entry point
@@ -55,12 +359,46 @@ def main(args):
     if not args.alignment.endswith('.bam'):
         exit('Error: Alignment must be in .bam format to enable random access.')
 
-    # Create .bai index if needed
-    if not exists(args.alignment + '.bai'):
-        pysam.index(args.alignment)
+    # Create the index if needed, once even if several tools start together
+    ensure_index(args.alignment, args.csi, args.threads)
 
-    profile = bam_length_profile(args.alignment, args.min_length, args.max_length)
-    output_fastq_lengths(profile)
+    if args.window:
+        step = args.step or args.window
+        if step <= 0 or args.window % step:
+            exit('Error: --step must be a positive divisor of --window.')
+        if args.length_class:
+            length_classes = [parse_length_bin(length_class)
+                              for length_class in args.length_class]
+        else:
+            length_classes = [('all', args.min_length or 0,
+                               args.max_length or np.iinfo(np.int64).max)]
+        if (args.npz or len(length_classes) > 1) and not args.output_prefix:
+            exit('Error: --npz and several length classes need '
+                 '--output_prefix.')
+        output_window_tracks(
+            window_tracks(args.alignment, args.window, step, length_classes,
+                          args.processes, args.threads),
+            length_classes, args.output_prefix, args.npz, args.window, step)
+    elif args.sample:
+        sample = bam_length_profile_sampled(
+            args.alignment, args.min_length, args.max_length, args.tolerance,
+            args.confidence, args.tile_size, args.seed, args.threads)
+        output_sampled_lengths(sample, args.min_length, args.confidence)
+    elif args.cache:
+        cache = ResultCache(args.cache_dir, args.cache_size * 1024 ** 2)
+        counts = cached_length_counts(args.alignment, cache, args.cache_hash,
+                                      args.processes, args.threads)
+        output_fastq_lengths(slice_length_profile(counts, args.min_length,
+                                                  args.max_length))
+    elif args.processes > 1:
+        profile = bam_length_profile_parallel(
+            args.alignment, args.min_length, args.max_length, args.processes,
+            args.threads)
+        output_fastq_lengths(profile)
+    else:
+        profile = bam_length_profile(args.alignment, args.min_length,
+                                     args.max_length, args.threads)
+        output_fastq_lengths(profile)
 
 
 if __name__ == '__main__':
@@ -3,13 +3,24 @@
 # Author: Jeffrey Grover
 # Purpose: Profile the read lengths which map to regions in a bed file
 # Created: 2019-08-14
-# Depends: pysam, samtools, python >= 3.6
+# Depends: pysam, samtools, numpy, python >= 3.6
 
-import pysam
 import gzip
-from os.path import exists
+import numpy as np
 from argparse import ArgumentParser
 from sys import exit
+from bam_io import REGION_SIZE, ensure_index, map_regions, open_bam
+from result_cache import (DEFAULT_CACHE_DIR, ResultCache, cache_key, file_hash,
+                          input_fingerprint)
+
+CLUSTER_GAP = 10000  # Features closer than this are read in one fetch
+READ_BATCH = 1 << 18  # Reads assigned to features at once
+CACHE_VERSION = 2  # Bump when the counting or the stored format changes
+NUCLEOTIDES = 'ACGTN'  # 5' nucleotide classes, other bases are counted as N
+STRANDS = '+-'
+N_CLASSES = len(NUCLEOTIDES) * len(STRANDS)
+FIVE_PRIME_CODE = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+REVERSE_FIVE_PRIME_CODE = {'A': 3, 'C': 2, 'G': 1, 'T': 0}
 
 
 def magic_open(input_file):
@@ -29,18 +40,254 @@ def bed_iter(input_file):
                    'name': entry[3]}
 
 
-def profile_reads_by_region(align_file, bed_iter, min_len, max_len):
+# Features on one chromosome, sorted by start, with their row in the output
+
+def features_by_chrom(features):
+    chrom_features = {}
+    for i, entry in enumerate(features):
+        chrom_features.setdefault(entry['chrom'], []).append(
+            (entry['start'], entry['end'], i))
+    for chrom, entries in chrom_features.items():
+        entries.sort()
+        yield chrom, np.array(entries, dtype=np.int64).reshape(-1, 3)
+
+
+# Runs of features with less than CLUSTER_GAP between them, as index ranges
+
+def feature_clusters(starts, ends):
+    cluster_ends = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] - cluster_ends[:-1] >= CLUSTER_GAP) + 1
+    bounds = np.concatenate(([0], breaks, [len(starts)]))
+    return zip(bounds[:-1].tolist(), bounds[1:].tolist())
+
+
+# Add a batch of reads, sorted by start, to the counts of every feature they
+# overlap (read start < feature end and read end > feature start). Reads that
+# start inside a feature are counted from per-length cumulative sums between
+# two binary searches; reads that start before the feature and run into it
+# are few, and are paired with their features explicitly.
+
+def assign_reads(counts, feature_starts, feature_ends, feature_rows,
+                 max_feature_length, read_starts, read_ends, length_index):
+    first = np.searchsorted(feature_starts,
+                            read_starts[0] - max_feature_length, 'right')
+    last = np.searchsorted(feature_starts, read_ends.max(), 'left')
+    starts = feature_starts[first:last]
+    ends = feature_ends[first:last]
+    rows = feature_rows[first:last]
+    inside_first = np.searchsorted(read_starts, starts, 'left')
+    inside_last = np.searchsorted(read_starts, ends, 'left')
+    for length in np.unique(length_index).tolist():
+        cumulative = np.concatenate(
+            ([0], np.cumsum(length_index == length)))
+        counts[rows, length] += (cumulative[inside_last] -
+                                 cumulative[inside_first])
+    max_span = int((read_ends - read_starts).max())
+    before_first = np.searchsorted(read_starts, starts - max_span, 'right')
+    n_before = inside_first - before_first
+    pair_feature = np.repeat(np.arange(len(starts)), n_before)
+    pair_read = (np.arange(n_before.sum()) -
+                 np.repeat(np.cumsum(n_before) - n_before, n_before) +
+                 np.repeat(before_first, n_before))
+    overlapping = read_ends[pair_read] > starts[pair_feature]
+    np.add.at(counts, (rows[pair_feature[overlapping]],
+                       length_index[pair_read[overlapping]]), 1)
+
+
+# Column of a read's 5' nucleotide and strand within its length. Reverse
+# strand reads are stored as their reference complement, so their 5'
+# nucleotide is the complement of the last base.
+
+def nucleotide_strand_class(aln):
+    sequence = aln.query_sequence
+    if not sequence:
+        return (len(NUCLEOTIDES) - 1) * 2 + aln.is_reverse
+    if aln.is_reverse:
+        return REVERSE_FIVE_PRIME_CODE.get(sequence[-1], 4) * 2 + 1
+    return FIVE_PRIME_CODE.get(sequence[0], 4) * 2
+
+
+# Count the reads overlapping a set of features on one chromosome, returning
+# one row of counts per feature in the order given. With by_nucleotide each
+# length has N_CLASSES columns, by 5' nucleotide and then strand.
+
+def count_features(align_handle, chrom, entries, min_len, max_len,
+                   by_nucleotide=False):
+    n_classes = N_CLASSES if by_nucleotide else 1
+    counts = np.zeros((len(entries), (max_len - min_len + 1) * n_classes),
+                      dtype=np.int64)
+    starts, ends = entries[:, 0], entries[:, 1]
+    rows = np.arange(len(entries))
+    for first, last in feature_clusters(starts, ends):
+        cluster_starts = starts[first:last]
+        cluster_ends = ends[first:last]
+        max_feature_length = int((cluster_ends - cluster_starts).max())
+        batch = []
+        reads = align_handle.fetch(chrom, int(cluster_starts[0]),
+                                   int(cluster_ends.max()))
+        for aln in reads:
+            read_length = aln.query_length
+            if min_len <= read_length <= max_len:
+                read_end = aln.reference_end
+                if read_end is None:  # htslib treats these as 1 bp
+                    read_end = aln.reference_start + 1
+                column = read_length - min_len
+                if by_nucleotide:
+                    column = (column * N_CLASSES +
+                              nucleotide_strand_class(aln))
+                batch.append((aln.reference_start, read_end, column))
+            if len(batch) == READ_BATCH:
+                assign_reads(counts, cluster_starts, cluster_ends,
+                             rows[first:last], max_feature_length,
+                             *np.array(batch, dtype=np.int64).T)
+                batch = []
+        if batch:
+            assign_reads(counts, cluster_starts, cluster_ends, rows[first:last],
+                         max_feature_length, *np.array(batch, dtype=np.int64).T)
+    return counts
+
+
+def count_features_worker(align_file, chrom, entries, min_len, max_len,
+                          threads=1, by_nucleotide=False):
+    with open_bam(align_file, threads) as align_handle:
+        return count_features(align_handle, chrom, entries, min_len, max_len,
+                              by_nucleotide)
+
+
+# Units of work: runs of whole feature clusters spanning about REGION_SIZE of
+# one chromosome, skipping chromosomes missing from the alignment
+
+def feature_units(features, references):
+    for chrom, entries in features_by_chrom(features):
+        if chrom not in references:
+            continue
+        unit_first = 0
+        unit_start = entries[0, 0]
+        for first, last in feature_clusters(entries[:, 0], entries[:, 1]):
+            if entries[last - 1, 1] - unit_start >= REGION_SIZE:
+                yield chrom, entries[unit_first:last]
+                unit_first = last
+                if last < len(entries):
+                    unit_start = entries[last, 0]
+        if unit_first < len(entries):
+            yield chrom, entries[unit_first:]
+
+
+def count_reads_by_feature(align_file, features, min_len, max_len,
+                           processes=1, threads=1, by_nucleotide=False):
+    n_classes = N_CLASSES if by_nucleotide else 1
+    counts = np.zeros((len(features), (max_len - min_len + 1) * n_classes),
+                      dtype=np.int64)
+    with open_bam(align_file, threads) as align_handle:
+        units = list(feature_units(features, set(align_handle.references)))
+        if processes <= 1:
+            results = [count_features(align_handle, chrom, entries, min_len,
+                                      max_len, by_nucleotide)
+                       for chrom, entries in units]
+    if processes > 1:
+        results = map_regions(count_features_worker, align_file, units,
+                              processes, min_len, max_len, threads,
+                              by_nucleotide)
+    for (chrom, entries), unit_counts in zip(units, results):
+        counts[entries[:, 2]] = unit_counts
+    return counts
+
+
+# Cached mode. The feature by length matrix of the lengths asked for is stored
+# on disk, keyed by the .bam and the contents of the .bed, as its non-zero
+# cells in the smallest integer types that hold them. Windows inside the
+# stored lengths are read from it; any other window is counted over the union
+# of both and replaces it.
+
+def sparse_counts(counts):
+    rows, columns = np.nonzero(counts)
+    values = counts[rows, columns]
+    return {'rows': rows.astype(np.min_scalar_type(len(counts))),
+            'columns': columns.astype(np.min_scalar_type(counts.shape[1])),
+            'values': values.astype(np.min_scalar_type(
+                int(values.max()) if len(values) else 0)),
+            'shape': np.array(counts.shape, dtype=np.int64)}
+
+
+def dense_columns(entry, first, last):
+    counts = np.zeros((int(entry['shape'][0]), last - first), dtype=np.int64)
+    columns = entry['columns'].astype(np.int64)
+    keep = (columns >= first) & (columns < last)
+    counts[entry['rows'][keep], columns[keep] - first] = entry['values'][keep]
+    return counts
+
+
+def cached_feature_counts(align_file, bed_file, features, min_len, max_len,
+                          cache, content_hash=False, processes=1, threads=1,
+                          by_nucleotide=False):
+    n_classes = N_CLASSES if by_nucleotide else 1
+    key = cache_key('bam_readlength_profile_by_bed', CACHE_VERSION,
+                    [input_fingerprint(align_file, content_hash),
+                     {'bed_sha256': file_hash(bed_file)}],
+                    by_nucleotide=by_nucleotide)
+    entry = cache.load(key)
+    if entry is not None:
+        cached_min = int(entry['min_length'])
+        cached_max = int(entry['max_length'])
+        if cached_min <= min_len and max_len <= cached_max:
+            return dense_columns(entry, (min_len - cached_min) * n_classes,
+                                 (max_len - cached_min + 1) * n_classes)
+        count_min, count_max = (min(min_len, cached_min),
+                                max(max_len, cached_max))
+    else:
+        count_min, count_max = min_len, max_len
+    counts = count_reads_by_feature(align_file, features, count_min, count_max,
+                                    processes, threads, by_nucleotide)
+    cache.store(key, min_length=count_min, max_length=count_max,
+                **sparse_counts(counts))
+    return counts[:, (min_len - count_min) * n_classes:
+                  (max_len - count_min + 1) * n_classes]
+
+
+def output_feature_profiles(features, counts, min_len, max_len):
     print('feature', *range(min_len, max_len + 1), sep='\t')
-    for entry in bed_iter:
-        profile = {}
-        for length in range(min_len, max_len + 1):
-            profile.update({length: 0})
-        with pysam.AlignmentFile(align_file, 'rb') as align_handle:
-            for aln in align_handle.fetch(entry['chrom'], entry['start'], entry['end']):
-                read_length = aln.query_length
-                if min_len <= read_length <= max_len:
-                    profile[read_length] += 1
-        print(*[entry['name']] + [profile[key] for key in profile], sep='\t')
+    for entry, profile in zip(features, counts.tolist()):
+        print(*[entry['name']] + profile, sep='\t')
+
+
+# Feature by length by 5' nucleotide by strand counts, as a long table of the
+# non-zero cells or as arrays in a .npz
+
+def nucleotide_strand_tensor(counts, min_len, max_len):
+    return counts.reshape(len(counts), max_len - min_len + 1,
+                          len(NUCLEOTIDES), len(STRANDS))
+
+
+def output_nucleotide_strand_table(features, counts, min_len, max_len):
+    tensor = nucleotide_strand_tensor(counts, min_len, max_len)
+    cells = np.nonzero(tensor)
+    print('feature', 'length', 'nucleotide', 'strand', 'count', sep='\t')
+    for row, length, nucleotide, strand, count in zip(
+            *[index.tolist() for index in cells], tensor[cells].tolist()):
+        print(features[row]['name'], length + min_len, NUCLEOTIDES[nucleotide],
+              STRANDS[strand], count, sep='\t')
+
+
+def write_nucleotide_strand_npz(output_file, features, counts, min_len,
+                                max_len):
+    np.savez_compressed(
+        output_file,
+        counts=nucleotide_strand_tensor(counts, min_len, max_len),
+        feature=np.array([entry['name'] for entry in features]),
+        chrom=np.array([entry['chrom'] for entry in features]),
+        start=np.array([entry['start'] for entry in features], dtype=np.int64),
+        end=np.array([entry['end'] for entry in features], dtype=np.int64),
+        length=np.arange(min_len, max_len + 1),
+        nucleotide=np.array(list(NUCLEOTIDES)),
+        strand=np.array(list(STRANDS)))
+
+
+def profile_reads_by_region(align_file, bed_iter, min_len, max_len,
+                            processes=1, threads=1):
+    features = list(bed_iter)
+    counts = count_reads_by_feature(align_file, features, min_len, max_len,
+                                    processes, threads)
+    output_feature_profiles(features, counts, min_len, max_len)
 
 
 # Command line parser
@@ -63,6 +310,51 @@ def get_args():
                         help='Maximum length of reads to profile',
                         type=int,
                         metavar='INT')
+    parser.add_argument('-j', '--processes',
+                        help='Worker processes, each profiling the features in '
+                        'its own part of the genome (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-@', '--threads',
+                        help='Decompression threads for each open .bam '
+                        '(default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--csi',
+                        help='Build a .csi rather than .bai index if the .bam '
+                        'is not indexed (automatic for contigs over 512 Mb)',
+                        action='store_true')
+    parser.add_argument('-s', '--nucleotide_strand',
+                        help='Also split the counts of each length by 5\' '
+                        'nucleotide and strand, written as a long table of '
+                        'feature, length, nucleotide, strand and count',
+                        action='store_true')
+    parser.add_argument('-o', '--output',
+                        help='With --nucleotide_strand, write the feature by '
+                        'length by nucleotide by strand array to this .npz '
+                        'instead of a table',
+                        metavar='FILE.npz')
+    parser.add_argument('--cache',
+                        help='Store the feature by length counts on disk and '
+                        'answer later runs on the same .bam and .bed, with a '
+                        'length window inside the stored lengths, from them',
+                        action='store_true')
+    parser.add_argument('--cache_dir',
+                        help='Cache directory (default=%s)' % DEFAULT_CACHE_DIR,
+                        default=DEFAULT_CACHE_DIR,
+                        metavar='DIR')
+    parser.add_argument('--cache_size',
+                        help='Size in MB the cache is trimmed to, least '
+                        'recently used first (default=2048)',
+                        default=2048,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--cache_hash',
+                        help='Identify the .bam by a hash of its contents '
+                        'rather than its path, size and modification time',
+                        action='store_true')
     return parser.parse_args()
 
 
@@ -74,13 +366,35 @@ def main(args):
     if not args.alignment.endswith('.bam'):
         exit('Error: Alignment must be in .bam format to enable random access.')
 
-    # Create .bai index if needed
-    if not exists(args.alignment + '.bai'):
-        pysam.index(args.alignment)
+    # Create the index if needed, once even if several tools start together
+    ensure_index(args.alignment, args.csi, args.threads)
 
     # Process files
-    profile_reads_by_region(args.alignment, bed_iter(args.bed), args.min_length,
-                            args.max_length)
+    if args.cache or args.nucleotide_strand:
+        features = list(bed_iter(args.bed))
+        if args.cache:
+            cache = ResultCache(args.cache_dir, args.cache_size * 1024 ** 2)
+            counts = cached_feature_counts(
+                args.alignment, args.bed, features, args.min_length,
+                args.max_length, cache, args.cache_hash, args.processes,
+                args.threads, args.nucleotide_strand)
+        else:
+            counts = count_reads_by_feature(
+                args.alignment, features, args.min_length, args.max_length,
+                args.processes, args.threads, by_nucleotide=True)
+        if not args.nucleotide_strand:
+            output_feature_profiles(features, counts, args.min_length,
+                                    args.max_length)
+        elif args.output:
+            write_nucleotide_strand_npz(args.output, features, counts,
+                                        args.min_length, args.max_length)
+        else:
+            output_nucleotide_strand_table(features, counts, args.min_length,
+                                           args.max_length)
+    else:
+        profile_reads_by_region(args.alignment, bed_iter(args.bed),
+                                args.min_length, args.max_length,
+                                args.processes, args.threads)
 
 
 if __name__ == '__main__':
@@ -3,16 +3,26 @@
 # Author: Jeffrey Grover
 # Purpose: Output the unique aligned sequences found in a .bam file
 # Created: 2020-03-04
+# Depends: pysam, numpy
 
-import pysam
 from argparse import ArgumentParser
-from os.path import exists
 from sys import exit
+from bam_io import (ensure_index, genome_regions, map_regions, open_bam,
+                    region_reads)
+from copy import deepcopy
+from seq_counting import (PackedSequenceCounter, TopSequenceCounter,
+                          report_top_counter)
 
+BATCH_SIZE = 100000  # Reads passed to the packed counter at once
 
-def bam_count_seqs(input_bam, min_len, max_len):
+
+def bam_count_seqs(input_bam, min_len, max_len, packed=False, counter=None,
+                   threads=1):
+    if packed or counter is not None:
+        return bam_count_seqs_packed(input_bam, min_len, max_len, counter,
+                                     threads)
     profile_dict = {}
-    with pysam.AlignmentFile(input_bam, 'rb') as align_handle:
+    with open_bam(input_bam, threads) as align_handle:
         for aln in align_handle.fetch():
             if min_len <= aln.query_length <= max_len:
                 if aln.query_sequence not in profile_dict:
@@ -21,6 +31,67 @@ def bam_count_seqs(input_bam, min_len, max_len):
     return profile_dict
 
 
+def bam_count_seqs_packed(input_bam, min_len, max_len, counter=None,
+                          threads=1):
+    if counter is None:
+        counter = PackedSequenceCounter()
+    batch = []
+    with open_bam(input_bam, threads) as align_handle:
+        for aln in align_handle.fetch():
+            if min_len <= aln.query_length <= max_len:
+                batch.append(aln.query_sequence)
+                if len(batch) == BATCH_SIZE:
+                    counter.add_strings(batch)
+                    batch = []
+    counter.add_strings(batch)
+    return counter
+
+
+# Parallel mode. Each worker counts the reads starting in one region, into a
+# copy of the (empty) counter when one is given, and the counts are merged.
+
+def region_count_seqs(input_bam, contig, start, end, min_len, max_len,
+                      counter, threads=1):
+    profile_dict = {}
+    batch = []
+    with open_bam(input_bam, threads) as align_handle:
+        for aln in region_reads(align_handle, contig, start, end):
+            if min_len <= aln.query_length <= max_len:
+                if counter is None:
+                    if aln.query_sequence not in profile_dict:
+                        profile_dict.update({aln.query_sequence: 0})
+                    profile_dict[aln.query_sequence] += 1
+                    continue
+                batch.append(aln.query_sequence)
+                if len(batch) == BATCH_SIZE:
+                    counter.add_strings(batch)
+                    batch = []
+    if counter is None:
+        return profile_dict
+    counter.add_strings(batch)
+    return counter
+
+
+def bam_count_seqs_parallel(input_bam, min_len, max_len, processes,
+                            packed=False, counter=None, threads=1):
+    if packed and counter is None:
+        counter = PackedSequenceCounter()
+    partials = map_regions(region_count_seqs, input_bam,
+                           genome_regions(input_bam), processes, min_len,
+                           max_len, deepcopy(counter), threads)
+    if counter is not None:
+        for partial in partials:
+            counter.merge(partial)
+        return counter
+    profile_dict = {}
+    for partial in partials:
+        for sequence, count in partial.items():
+            if sequence not in profile_dict:
+                profile_dict.update({sequence: 0})
+            profile_dict[sequence] += count
+    return profile_dict
+
+
 def output_aligned_profile(profile_dict):
     print('sequence', 'count', sep='\t')
     for sequence, count in profile_dict.items():
@@ -43,6 +114,40 @@ def get_args():
                         help='Maximum length of reads to profile',
                         type=int,
                         metavar='INT')
+    parser.add_argument('-p', '--packed',
+                        help='Count sequences as 2-bit packed keys to save '
+                        'memory on deep libraries (output is grouped by length '
+                        'instead of in order of appearance)',
+                        action='store_true')
+    parser.add_argument('--top',
+                        help='Only report the INT most abundant sequences, '
+                        'sorted by count, using a fixed-size table instead of '
+                        'counting every sequence; the number of distinct '
+                        'sequences is estimated and reported on stderr',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--max_tracked',
+                        help='With --top, the most sequences held in memory; '
+                        'larger is more accurate (default=100000)',
+                        default=100000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-j', '--processes',
+                        help='Worker processes, each scanning its own contigs '
+                        'or contig chunks (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-@', '--threads',
+                        help='Decompression threads for each open .bam '
+                        '(default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--csi',
+                        help='Build a .csi rather than .bai index if the .bam '
+                        'is not indexed (automatic for contigs over 512 Mb)',
+                        action='store_true')
     return parser.parse_args()
 
 
@@ -54,12 +159,23 @@ def main(args):
     if not args.alignment.endswith('.bam'):
         exit('Error: Alignment must be in .bam format to enable random access.')
 
-    # Create .bai index if needed
-    if not exists(args.alignment + '.bai'):
-        pysam.index(args.alignment)
-
-    profile = bam_count_seqs(args.alignment, args.min_length, args.max_length)
+    # Create the index if needed, once even if several tools start together
+    ensure_index(args.alignment, args.csi, args.threads)
+
+    top_counter = None
+    if args.top:
+        top_counter = TopSequenceCounter(args.top, args.max_tracked)
+    if args.processes > 1:
+        profile = bam_count_seqs_parallel(
+            args.alignment, args.min_length, args.max_length, args.processes,
+            args.packed, top_counter, args.threads)
+    else:
+        profile = bam_count_seqs(args.alignment, args.min_length,
+                                 args.max_length, args.packed, top_counter,
+                                 args.threads)
     output_aligned_profile(profile)
+    if top_counter is not None:
+        report_top_counter(top_counter)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Sort .bed and .bedGraph files by chromosome then start (like
+# sort -k1,1 -k2,2n) within a memory budget, merging sorted runs from disk
+# Created: 2026-10-17
+# Depends: numpy
+
+import heapq
+import numpy as np
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain
+from os import getpid, remove, replace
+from os.path import basename, dirname, join, splitext
+from shutil import rmtree
+from sys import exit, stderr
+from tempfile import mkdtemp
+from bedgraph_io import (HEADER_PREFIXES, BedGraphChunk, bedgraph_chunks,
+                         line_buffers)
+from fastq_io import BlockWriter, gather_slices, magic_open, read_blocks
+
+MEMORY_BUDGET = 1024  # MB of memory for sorting, across all processes
+READ_SIZE = 16 * 1024 * 1024
+RUN_OVERHEAD = 6  # Peak memory of sorting a run, as a multiple of its size
+MERGE_FAN_IN = 64  # Most runs merged at once
+WRITE_LINES = 8192  # Lines copied out of a sorted run at a time
+
+
+def line_key(line):
+    fields = line.split(None, 2)
+    return fields[0], int(fields[1])
+
+
+# Chromosome names of every line of a chunk as a numpy bytes array, laid out
+# one character position at a time so temporaries stay a few bytes per line
+
+def chrom_names(chunk):
+    starts, ends = chunk.field_bounds(0)
+    width = max(int((ends - starts).max()), 1)
+    names = np.zeros((len(chunk), width), dtype=np.uint8)
+    for j in range(width):
+        has_char = np.flatnonzero(starts + j < ends)
+        names[has_char, j] = chunk.data[starts[has_char] + j]
+    return names.view('S%s' % width).ravel()
+
+
+# Check the order with the columnar reader: every line must have a greater
+# chromosome name than the line before, or the same name and no smaller
+# start. Chunks are sized to the budget, parsing costing several times their
+# size.
+
+def is_sorted(input_file, memory_budget=MEMORY_BUDGET):
+    chunk_size = max(memory_budget * 1024 * 1024 // (2 * RUN_OVERHEAD),
+                     1024 * 1024)
+    last_chrom, last_start = None, -1
+    for chunk in bedgraph_chunks(input_file, chunk_size):
+        if not len(chunk):
+            continue
+        names = chrom_names(chunk)
+        starts = chunk.column(1)
+        if last_chrom is not None and (
+                names[0] < last_chrom or
+                (names[0] == last_chrom and starts[0] < last_start)):
+            return False
+        if ((names[1:] < names[:-1]) |
+                ((names[1:] == names[:-1]) & (starts[1:] < starts[:-1]))).any():
+            return False
+        last_chrom, last_start = names[-1], int(starts[-1])
+    return True
+
+
+def header_lines(buffer):
+    if not buffer.startswith(HEADER_PREFIXES) and not any(
+            b'\n' + prefix in buffer for prefix in HEADER_PREFIXES):
+        return []
+    return [line for line in buffer.splitlines(True)
+            if line.startswith(HEADER_PREFIXES)]
+
+
+# Chromosome rank and start of every line of a chunk
+
+def sort_keys(chunk):
+    chrom_ranks = np.unique(chrom_names(chunk), return_inverse=True)[1]
+    return chrom_ranks.ravel(), chunk.column(1)
+
+
+# Sort one buffer of lines and write it as a run file, returning the header
+# lines it held so they can lead the output. Lines are ordered with a stable
+# lexsort on chromosome rank and start and copied out a slice at a time, so
+# no Python object is made per line.
+
+def sort_run(buffer, run_file):
+    headers = header_lines(buffer)
+    chunk = BedGraphChunk(buffer)
+    with open(run_file, 'wb') as output_handle:
+        if not len(chunk):
+            return headers
+        chrom_ranks, positions = sort_keys(chunk)
+        order = np.lexsort((positions, chrom_ranks))
+        del chrom_ranks, positions
+        for first in range(0, len(order), WRITE_LINES):
+            lines = order[first:first + WRITE_LINES]
+            starts = chunk.line_starts[lines]
+            ends = chunk.line_ends[lines]
+            ends += 1 + (chunk.data[ends] == 13)
+            data, offsets = gather_slices(chunk.data, starts, ends - starts)
+            output_handle.write(data.tobytes())
+    return headers
+
+
+def run_buffers(input_file, run_size):
+    with magic_open(input_file, 'rb') as input_handle:
+        run = []
+        run_bytes = 0
+        for buffer in line_buffers(read_blocks(input_handle,
+                                               min(READ_SIZE, run_size))):
+            if run and run_bytes + len(buffer) > run_size:
+                yield b''.join(run)
+                run = []
+                run_bytes = 0
+            run.append(buffer)
+            run_bytes += len(buffer)
+        if run:
+            yield b''.join(run)
+
+
+# Runs are sized so that the runs being sorted, each with its sorting
+# overhead, plus the block being read and its copy cut at a line end fit the
+# budget. With more than one process
+# they are sorted in a pool, never more than one run per process at a time.
+# The sorted runs are merged with a heap. Equal keys keep their input order.
+
+def external_sort(input_file, output_file, memory_budget=MEMORY_BUDGET,
+                  temp_dir=None, processes=1):
+    run_dir = mkdtemp(prefix='bed_sort.', dir=temp_dir)
+    run_size = max(memory_budget * 1024 * 1024 //
+                   (processes * (RUN_OVERHEAD + 1) + 2), 1024 * 1024)
+    try:
+        run_files = []
+        headers = []
+        if processes <= 1:
+            for i, buffer in enumerate(run_buffers(input_file, run_size)):
+                run_files.append(join(run_dir, 'run%s' % i))
+                headers += sort_run(buffer, run_files[-1])
+                del buffer
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                futures = []
+                for i, buffer in enumerate(run_buffers(input_file, run_size)):
+                    while sum(not f.done() for f in futures) >= processes:
+                        wait(futures, return_when=FIRST_COMPLETED)
+                    run_files.append(join(run_dir, 'run%s' % i))
+                    futures.append(pool.submit(sort_run, buffer,
+                                               run_files[-1]))
+                    del buffer
+                headers = [line for future in futures
+                           for line in future.result()]
+        run_files = merge_passes(run_files, run_dir)
+        write_merged(run_files, headers, output_file)
+    finally:
+        rmtree(run_dir)
+
+
+def merged_lines(run_handles):
+    return heapq.merge(*run_handles, key=line_key)
+
+
+# Merge runs MERGE_FAN_IN at a time into larger runs until few enough are left
+# to merge into the output in one pass. Consecutive runs are merged together,
+# so equal keys still keep their input order.
+
+def merge_passes(run_files, run_dir, fan_in=MERGE_FAN_IN):
+    n_pass = 0
+    while len(run_files) > fan_in:
+        merged_files = []
+        for first in range(0, len(run_files), fan_in):
+            group = run_files[first:first + fan_in]
+            merged_files.append(join(run_dir, 'pass%s.%s' % (n_pass, first)))
+            run_handles = [open(run_file, 'rb') for run_file in group]
+            try:
+                with open(merged_files[-1], 'wb') as output_handle:
+                    output_handle.writelines(merged_lines(run_handles))
+            finally:
+                for handle in run_handles:
+                    handle.close()
+            for run_file in group:
+                remove(run_file)
+        run_files = merged_files
+        n_pass += 1
+    return run_files
+
+
+def write_merged(run_files, headers, output_file):
+    run_handles = [open(run_file, 'rb') for run_file in run_files]
+    try:
+        write_output(output_file, chain(headers, merged_lines(run_handles)))
+    finally:
+        for handle in run_handles:
+            handle.close()
+
+
+# Output goes to a temporary name that is renamed into place, so jobs sharing
+# an input never see a partial file
+
+def write_output(output_file, blocks):
+    temp_file = '%s.tmp%s' % (output_file, getpid())
+    with BlockWriter(temp_file, output_file.endswith('.gz')) as writer:
+        for block in blocks:
+            writer.write(block)
+    replace(temp_file, output_file)
+
+
+# Sort unless the input is already sorted. Returns the path of the sorted
+# data, which is the input itself when no sort was needed and no output was
+# asked for.
+
+def sort_bed(input_file, output_file=None, memory_budget=MEMORY_BUDGET,
+             temp_dir=None, processes=1):
+    if is_sorted(input_file, memory_budget):
+        print('Already sorted: %s' % input_file, file=stderr)
+        if output_file is None:
+            return input_file
+        with magic_open(input_file, 'rb') as input_handle:
+            write_output(output_file, read_blocks(input_handle, READ_SIZE))
+        return output_file
+    if output_file is None:
+        output_file = sorted_path(input_file)
+    external_sort(input_file, output_file, memory_budget, temp_dir, processes)
+    return output_file
+
+
+# FILE.bedGraph(.gz) -> FILE.sorted.bedGraph(.gz), always a new name
+
+def sorted_path(input_file, output_dir=None):
+    name = basename(input_file)
+    suffix = ''
+    if name.endswith('.gz'):
+        name, suffix = name[:-3], '.gz'
+    root, extension = splitext(name)
+    return join(dirname(input_file) if output_dir is None else output_dir,
+                '%s.sorted%s%s' % (root, extension, suffix))
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Sort a .bed or .bedGraph file by chromosome and start. '
+        'Files larger than the memory budget are sorted in runs that are '
+        'merged from disk; sorted files are left as they are.')
+    parser.add_argument('input',
+                        help='Input .bed or .bedGraph',
+                        metavar='FILE(.gz)')
+    parser.add_argument('-o', '--output',
+                        help='Output file, gzipped if it ends in .gz '
+                        '(default=FILE.sorted.ext)',
+                        metavar='FILE')
+    parser.add_argument('-S', '--memory',
+                        help='Memory budget in MB (default=%s)' % MEMORY_BUDGET,
+                        default=MEMORY_BUDGET,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-T', '--temp_dir',
+                        help='Directory for the sorted runs (default=system '
+                        'temporary directory)',
+                        metavar='DIR')
+    parser.add_argument('-p', '--processes',
+                        help='Worker processes sorting runs (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    output_file = args.output or sorted_path(args.input)
+    if output_file == args.input:
+        exit('Error: Output would overwrite the input.')
+    try:
+        sort_bed(args.input, output_file, args.memory, args.temp_dir,
+                 args.processes)
+    except ValueError as error:
+        exit('Error: %s' % error)
+
+
+if __name__ == '__main__':
+    main(get_args())
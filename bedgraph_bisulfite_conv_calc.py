@@ -3,36 +3,19 @@
 # Author: Jeffrey Grover
 # Purpose: Determine bisulfite conversion rate from MethylDackel bedGraph files
 # Created: 2/2019
+# Depends: numpy
 
-import gzip
 from argparse import ArgumentParser
-
-
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
-
-
-def parse_bedgraph(input_context_bedgraph):
-    met_count = 0
-    unmet_count = 0
-    with magic_open(input_context_bedgraph) as input_handle:
-        next(input_handle)  # Skip header
-        for line in input_handle:
-            entry = line.strip().split()
-            met_count += int(entry[4])
-            unmet_count += int(entry[5])
-    return (met_count, unmet_count)
+from bedgraph_io import bedgraph_chrom_totals, map_bedgraphs, sum_totals
+from bedgraph_percent_methylation import output_chrom_table
 
 
 def conversion_calc(cg_counts, chg_counts, chh_counts):
     total_cg = cg_counts[0] + cg_counts[1]
     total_chg = chg_counts[0] + chg_counts[1]
     total_chh = chh_counts[0] + chh_counts[1]
-    conversion_rate = (sum(cg_counts[1], chg_counts[1], chh_counts[1]) /
-                       sum(total_cg, total_chg, total_chh)) * 100
+    conversion_rate = ((cg_counts[1] + chg_counts[1] + chh_counts[1]) /
+                       (total_cg + total_chg + total_chh)) * 100
     return conversion_rate
 
 
@@ -54,6 +37,23 @@ def get_args():
     parser.add_argument('--CHH',
                         help='CHH context bedGraph file.',
                         metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('--control',
+                        help='Also report the conversion rate on this '
+                        'unmethylated control contig (chloroplast or a lambda '
+                        'spike-in for example); repeatable',
+                        action='append',
+                        default=[],
+                        metavar='CONTIG')
+    parser.add_argument('-c', '--by_chrom',
+                        help='Also write per-chromosome methylation and '
+                        'conversion rates to this file',
+                        metavar='FILE.tsv')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of context files to read at once '
+                        '(default=3)',
+                        default=3,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
@@ -61,9 +61,11 @@ def get_args():
 
 
 def main(args):
-    cg_counts = parse_bedgraph(args.CG)
-    chg_counts = parse_bedgraph(args.CHG)
-    chh_counts = parse_bedgraph(args.CHH)
+    # One read of each context file gives every total below
+    context_totals = map_bedgraphs(
+        bedgraph_chrom_totals, [args.CG, args.CHG, args.CHH], args.jobs)
+    cg_counts, chg_counts, chh_counts = [sum_totals(chrom_totals)
+                                         for chrom_totals in context_totals]
     conversion_rate = conversion_calc(cg_counts, chg_counts, chh_counts)
 
     print('CG Methylated/Total:\t', cg_counts[0], '/', sum(cg_counts))
@@ -71,6 +73,20 @@ def main(args):
     print('CHH Methylated/Total:\t', chh_counts[0], '/', sum(chh_counts))
     print('Conversion Rate:\t', conversion_rate)
 
+    for control in args.control:
+        control_counts = [sum_totals(chrom_totals, {control})
+                          for chrom_totals in context_totals]
+        try:
+            control_rate = conversion_calc(*control_counts)
+        except ZeroDivisionError:
+            control_rate = 'NA'  # No sites on the control contig
+        print('Conversion Rate (%s):\t' % control, control_rate)
+
+    if args.by_chrom:
+        with open(args.by_chrom, 'w') as output_handle:
+            output_chrom_table(['CG', 'CHG', 'CHH'], context_totals,
+                               output_handle)
+
 
 if __name__ == '__main__':
     main(get_args())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Shared .bedGraph reading functions for the bedgraph_* scripts
+# Created: 2026-10-17
+# Depends: numpy
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from fastq_io import magic_open, read_blocks
+
+CHUNK_SIZE = 16 * 1024 * 1024  # Bytes of decompressed .bedGraph per chunk
+HEADER_PREFIXES = (b'track', b'browser', b'#')
+
+
+# Split an iterator of byte blocks into buffers of complete lines
+
+def line_buffers(byte_blocks):
+    leftover = b''
+    for block in byte_blocks:
+        buffer = leftover + block
+        cut = buffer.rfind(b'\n') + 1
+        leftover = buffer[cut:]
+        if cut:
+            yield buffer[:cut]
+    if leftover.strip():
+        yield leftover + b'\n'
+
+
+# Parse the unsigned decimal integers at data[starts:ends] all at once, one
+# digit position at a time across every field, so the temporaries are a few
+# values per field rather than per digit
+
+def parse_int_fields(data, starts, ends):
+    lengths = ends - starts
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    if lengths.min() < 1 or lengths.max() > 18:
+        raise ValueError('Empty or overlong integer field in .bedGraph')
+    values = np.zeros(len(lengths), dtype=np.int64)
+    for j in range(int(lengths.max())):
+        fields = np.flatnonzero(lengths > j)
+        digits = data[starts[fields] + j].astype(np.int64) - 48
+        if digits.min() < 0 or digits.max() > 9:
+            raise ValueError('Non-integer value in .bedGraph count column')
+        values[fields] = values[fields] * 10 + digits
+    return values
+
+
+# A block of complete lines held as a uint8 array. Fields are separated by
+# runs of tabs or spaces, as with str.split(), and located from the first and
+# last byte of every run of other bytes; only the columns asked for are
+# parsed, so no Python string is created per line. Header lines (track,
+# browser and comments) and blank lines are dropped wherever they are.
+
+class BedGraphChunk:
+    def __init__(self, buffer):
+        self.data = np.frombuffer(buffer, dtype=np.uint8)
+        newlines = np.flatnonzero(self.data == 10)
+        line_starts = np.empty_like(newlines)
+        line_starts[0] = 0
+        line_starts[1:] = newlines[:-1] + 1
+        line_ends = newlines - (self.data[newlines - 1] == 13)
+        in_field = ((self.data != 9) & (self.data != 32) &
+                    (self.data != 10) & (self.data != 13))
+        edges = np.flatnonzero(in_field[1:] != in_field[:-1]) + 1
+        if in_field[0]:
+            edges = np.concatenate(([0], edges))
+        self.field_starts = edges[0::2]
+        self.field_ends = edges[1::2]
+        del in_field, edges
+        self.first_field = np.searchsorted(self.field_starts, line_starts)
+        keep = (self.first_field < len(self.field_starts))
+        keep[keep] = (self.field_starts[self.first_field[keep]] <
+                      line_ends[keep])
+        first_bytes = self.data[line_starts[keep]]
+        if np.isin(first_bytes, (ord('t'), ord('b'), ord('#'))).any():
+            keep[keep] = [not buffer[start:start + 7].startswith(
+                HEADER_PREFIXES) if byte in b'tb#' else True
+                for start, byte in zip(line_starts[keep].tolist(),
+                                       first_bytes.tolist())]
+        self.line_starts = line_starts[keep]
+        self.line_ends = line_ends[keep]
+        self.first_field = self.first_field[keep]
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.line_starts)
+
+    # Start and end of column k (0-based) on every line
+
+    def field_bounds(self, k):
+        index = self.first_field + k
+        if not len(index):
+            return index, index
+        if (index.max() >= len(self.field_starts) or
+                (self.field_starts[np.minimum(index, len(self.field_starts) -
+                                              1)] >= self.line_ends).any()):
+            raise ValueError('.bedGraph line with fewer than %s columns'
+                             % (k + 1))
+        return self.field_starts[index], self.field_ends[index]
+
+    def column(self, k):
+        if k not in self._columns:
+            self._columns[k] = parse_int_fields(self.data,
+                                                *self.field_bounds(k))
+        return self._columns[k]
+
+    # Runs of consecutive lines on the same chromosome, as (chrom, first,
+    # last) with last exclusive
+
+    def chrom_runs(self):
+        if not len(self):
+            return []
+        starts, ends = self.field_bounds(0)
+        lengths = ends - starts
+        width = int(lengths.max())
+        index = starts[:, None] + np.arange(width)
+        names = np.where(index < ends[:, None],
+                         self.data[np.minimum(index, len(self.data) - 1)], 0)
+        changes = np.flatnonzero((names[1:] != names[:-1]).any(axis=1)) + 1
+        bounds = np.concatenate(([0], changes, [len(self)])).tolist()
+        return [(names[first, :lengths[first]].tobytes().decode(), first, last)
+                for first, last in zip(bounds[:-1], bounds[1:])]
+
+    # Lines of each chromosome: slices for sorted input, where each chromosome
+    # is one run, and index arrays otherwise
+
+    def chrom_groups(self):
+        runs = self.chrom_runs()
+        names = [name for name, first, last in runs]
+        if len(set(names)) == len(names):
+            return [(name, slice(first, last)) for name, first, last in runs]
+        chrom_ids = {}
+        run_ids = [chrom_ids.setdefault(name, len(chrom_ids)) for name in names]
+        line_ids = np.repeat(run_ids, [last - first
+                                       for name, first, last in runs])
+        order = np.argsort(line_ids, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(line_ids))))
+        return [(name, order[bounds[i]:bounds[i + 1]])
+                for name, i in chrom_ids.items()]
+
+
+def bedgraph_chunks(input_bedgraph, chunk_size=CHUNK_SIZE):
+    with magic_open(input_bedgraph, 'rb') as input_handle:
+        for buffer in line_buffers(read_blocks(input_handle, chunk_size)):
+            chunk = BedGraphChunk(buffer)
+            if len(chunk):
+                yield chunk
+
+
+# Methylated (column 5) and unmethylated (column 6) totals of each chromosome,
+# in order of first appearance, and their sum over some or all chromosomes
+
+def bedgraph_chrom_totals(input_bedgraph):
+    chrom_totals = {}
+    for chunk in bedgraph_chunks(input_bedgraph):
+        met, unmet = chunk.column(4), chunk.column(5)
+        for chrom, lines in chunk.chrom_groups():
+            totals = chrom_totals.setdefault(chrom, [0, 0])
+            totals[0] += int(met[lines].sum())
+            totals[1] += int(unmet[lines].sum())
+    return chrom_totals
+
+
+def sum_totals(chrom_totals, chroms=None):
+    met_count = 0
+    unmet_count = 0
+    for chrom, (chrom_met, chrom_unmet) in chrom_totals.items():
+        if chroms is None or chrom in chroms:
+            met_count += chrom_met
+            unmet_count += chrom_unmet
+    return met_count, unmet_count
+
+
+# Run a function over several .bedGraph files at once, one file per worker,
+# returning the results in file order. Any further lists give each call its
+# own extra arguments, as with map().
+
+def map_bedgraphs(function, input_bedgraphs, jobs, *arg_lists):
+    if jobs <= 1 or len(input_bedgraphs) <= 1:
+        return list(map(function, input_bedgraphs, *arg_lists))
+    with ProcessPoolExecutor(min(jobs, len(input_bedgraphs))) as pool:
+        return list(pool.map(function, input_bedgraphs, *arg_lists))
@@ -3,50 +3,114 @@
 # Author: Jeffrey Grover
 # Purpose: Calculate percent methylation per feature in a .bed file
 # Created: 2019-07-12
-# Depends: GNU Sort, bedtools
+# Depends: numpy
 
-import subprocess
+import numpy as np
 from argparse import ArgumentParser
-from sys import stderr
-from os import getpid, remove
+from sys import exit, stderr, stdout
+from bed_sort import sort_bed, sorted_path
+from bedgraph_io import HEADER_PREFIXES, bedgraph_chunks
+from fastq_io import magic_open
+from methylation_index import default_index_dir, open_index
 
+WRITE_LINES = 100000  # Output lines joined per write
 
-# Sorting and calculation functions
 
-def sort_bedgraph(input_file, output_file):
-    subprocess.run(
-        "sed '1d' {} | sort -k1,1 -k2,2n > {}".format(input_file, output_file),
-        shell=True
-    )
+# Features are held in memory, in the order `sort -k1,1 -k2,2n` would give
+# unless they are already sorted, and indexed by chromosome
 
-
-def sort_features_bed(input_file, output_file):
-    subprocess.run(
-        'sort -k1,1 -k2,2n {} > {}'.format(input_file, output_file),
-        shell=True
-    )
-
-
-def bedtools_map_sum(input_bed, input_bedgraph, output_file):
-    subprocess.run(
-        'bedtools map -a {} -b {} -c 5,6 -o sum,sum -null 0 > {}'.format(
-            input_bed, input_bedgraph, output_file
-        ), shell=True
-    )
-
-
-def calc_methylation(input_file, mincov):
-    with open(input_file, 'r') as input_handle:
+def read_features(input_bed, keep_order=False):
+    features = []
+    with magic_open(input_bed) as input_handle:
         for line in input_handle:
-            entry = line.strip().split()
-            nC = int(entry[4])
-            nT = int(entry[5])
-            if (nC + nT) >= mincov:
-                try:
-                    perc_met = nC / (nC + nT) * 100
-                except ZeroDivisionError:
-                    perc_met = 'NA'  # Indicate missing data for zero depth
-                print(*entry[0:4], perc_met, sep='\t')
+            if line.strip() and not line.encode().startswith(HEADER_PREFIXES):
+                features.append(line.strip().split())
+    if not keep_order:
+        features.sort(key=lambda entry: (entry[0], int(entry[1]), entry))
+    return features
+
+
+def features_by_chrom(features):
+    chrom_rows = {}
+    for i, entry in enumerate(features):
+        chrom_rows.setdefault(entry[0], []).append(i)
+    for chrom, rows in chrom_rows.items():
+        chrom_rows[chrom] = (
+            np.array(rows, dtype=np.int64),
+            np.array([int(features[i][1]) for i in rows], dtype=np.int64),
+            np.array([int(features[i][2]) for i in rows], dtype=np.int64))
+    return chrom_rows
+
+
+# Sum of the weights of every site overlapping each feature (site start <
+# feature end and site end > feature start). Since a site's end is past its
+# start, that is the sites starting before the feature end less those ending
+# at or before the feature start, both read off cumulative sums by binary
+# search, so the sites need not be sorted and overlapping features are free.
+
+def prefix_sums(positions, weights):
+    if (positions[1:] < positions[:-1]).any():
+        order = np.argsort(positions, kind='stable')
+        positions, weights = positions[order], weights[order]
+    sums = np.zeros((len(weights) + 1, weights.shape[1]), dtype=np.int64)
+    np.cumsum(weights, axis=0, out=sums[1:])
+    return positions, sums
+
+
+def overlap_sums(site_starts, site_ends, weights, feature_starts,
+                 feature_ends):
+    starts, start_sums = prefix_sums(site_starts, weights)
+    ends, end_sums = prefix_sums(site_ends, weights)
+    return (start_sums[np.searchsorted(starts, feature_ends, 'left')] -
+            end_sums[np.searchsorted(ends, feature_starts, 'right')])
+
+
+# Stream the .bedGraph a chunk at a time, adding the methylated (column 5) and
+# unmethylated (column 6) counts of each chromosome's sites to its features
+
+def sum_methylation(input_bedgraph, features):
+    return sum_chrom_features(input_bedgraph, features_by_chrom(features),
+                              len(features))
+
+
+def sum_chrom_features(input_bedgraph, chrom_features, n_features):
+    sums = np.zeros((n_features, 2), dtype=np.int64)
+    for chunk in bedgraph_chunks(input_bedgraph):
+        site_starts, site_ends = chunk.column(1), chunk.column(2)
+        weights = np.stack((chunk.column(4), chunk.column(5)), axis=1)
+        for chrom, lines in chunk.chrom_groups():
+            if chrom in chrom_features:
+                rows, feature_starts, feature_ends = chrom_features[chrom]
+                sums[rows] += overlap_sums(
+                    site_starts[lines], site_ends[lines], weights[lines],
+                    feature_starts, feature_ends)
+    return sums
+
+
+# Indexed mode. The .bedGraph is converted once into a memory-mapped index and
+# each feature is then two binary searches and a subtraction.
+
+def index_methylation(index, features):
+    sums = np.zeros((len(features), 2), dtype=np.int64)
+    for chrom, (rows, feature_starts, feature_ends) in features_by_chrom(
+            features).items():
+        sums[rows] = index.overlap_sums(chrom, feature_starts, feature_ends)
+    return sums
+
+
+def calc_methylation(features, sums, mincov, output_handle=stdout):
+    lines = []
+    for entry, (nC, nT) in zip(features, sums.tolist()):
+        if (nC + nT) >= mincov:
+            try:
+                perc_met = nC / (nC + nT) * 100
+            except ZeroDivisionError:
+                perc_met = 'NA'  # Indicate missing data for zero depth
+            lines.append('\t'.join(entry[0:4] + [str(perc_met)]) + '\n')
+            if len(lines) == WRITE_LINES:
+                output_handle.write(''.join(lines))
+                lines = []
+    output_handle.write(''.join(lines))
 
 
 # Get command line options
@@ -58,21 +122,34 @@ def get_args():
         'methylation calls from a .bedGraph file (from MethylDackel for '
         'example).')
     parser.add_argument('-b', '--bed',
-                        help='bed file to process, three columns only',
+                        help='bed file to process, four columns (chrom, start, '
+                        'end, name), tab- or space-delimited',
                         metavar='FILE.bed')
     parser.add_argument('-g', '--bedGraph',
-                        help='bedGraph file of methylation calls',
-                        metavar='FILE.bedGraph')
+                        help='bedGraph file of methylation calls, in any '
+                        'order, tab- or space-delimited',
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('-i', '--index',
+                        help='Sum over a memory-mapped index of the bedGraph, '
+                        'built (at FILE.bedGraph.index unless DIR is given) '
+                        'when missing or out of date; without --bedGraph, use '
+                        'the existing index in DIR',
+                        nargs='?',
+                        const='',
+                        metavar='DIR')
     parser.add_argument('-m', '--mincov',
                         help='Minimum coverage value to report methylation',
                         metavar='INT',
                         type=int,
                         default=0)
     parser.add_argument('-s', '--sorted',
-                        help='Input files have been pre-sorted',
+                        help='Input files have been pre-sorted; features are '
+                        'reported in the order given',
                         action='store_true')
     parser.add_argument('-k', '--keep_sorted',
-                        help='Keep the sorted intermediate files',
+                        help='Also write sorted copies of the inputs as '
+                        'FILE.sorted.bed and FILE.sorted.bedGraph (not needed '
+                        'for the calculation)',
                         action='store_true')
     return parser.parse_args()
 
@@ -80,30 +157,27 @@ def get_args():
 # Run
 
 def main(args):
-    if not args.sorted:
-        print('Sorting MethylDackel .bedGraph file: %s' % args.bedGraph, file=stderr)
-        sorted_bedGraph = args.bedGraph.replace('.bedGraph', '.sorted.bedGraph')
-        sort_bedgraph(args.bedGraph, sorted_bedGraph)
-
-        print('Sorting features .bed file: %s' % args.bed, file=stderr)
-        sorted_features_bed = args.bed.replace('.bed', '.sorted.bed')
-        sort_features_bed(args.bed, sorted_features_bed)
-    else:
-        sorted_bedGraph = args.bedGraph
-        sorted_features_bed = args.bed
+    print('Reading features .bed file: %s' % args.bed, file=stderr)
+    features = read_features(args.bed, args.sorted)
 
     print('Summing methylation over features...', file=stderr)
-    sum_filename = 'bedtools_map_sum.%s.tmp' % getpid()
-    bedtools_map_sum(sorted_features_bed, sorted_bedGraph, sum_filename)
+    if args.index is not None:
+        if not args.index and not args.bedGraph:
+            exit('Error: --index needs a directory or --bedGraph.')
+        index = open_index(args.index or default_index_dir(args.bedGraph),
+                           args.bedGraph)
+        sums = index_methylation(index, features)
+    else:
+        sums = sum_methylation(args.bedGraph, features)
 
     print('Calculating percent methylation per feature...', file=stderr)
-    calc_methylation(sum_filename, args.mincov)
+    calc_methylation(features, sums, args.mincov)
 
-    print('Cleaning up temporary files...', file=stderr)
-    if not args.keep_sorted and not args.sorted:
-        remove(sorted_features_bed)
-        remove(sorted_bedGraph)
-    remove(sum_filename)
+    if args.keep_sorted and not args.sorted:
+        for input_file in (args.bed, args.bedGraph):
+            if input_file:
+                print('Writing sorted copy of %s' % input_file, file=stderr)
+                sort_bed(input_file, sorted_path(input_file))
 
 
 if __name__ == '__main__':
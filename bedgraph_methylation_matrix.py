@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Calculate percent methylation and coverage per feature in a .bed
+# file for many bedGraph files at once, as one feature by sample matrix
+# Created: 2026-10-17
+# Depends: numpy
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from sys import exit, stderr, stdout
+from bedgraph_methylation_by_bed import (WRITE_LINES, features_by_chrom,
+                                         read_features, sum_chrom_features)
+from fastq_io import read_sample_sheet, sample_name
+
+BEDGRAPH_SUFFIXES = ('.gz', '.bedGraph', '.bedgraph', '.bg')
+
+# Features prepared in the parent and handed to each worker once, when it
+# starts, rather than with every bedGraph
+worker_features = None
+
+
+def init_worker(chrom_features, n_features):
+    global worker_features
+    worker_features = (chrom_features, n_features)
+
+
+def score_bedgraph(input_bedgraph):
+    return sum_chrom_features(input_bedgraph, *worker_features)
+
+
+def score_samples(samples, features, jobs=1):
+    chrom_features = features_by_chrom(features)
+    if jobs <= 1:
+        init_worker(chrom_features, len(features))
+        return [score_bedgraph(path) for name, path in samples]
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(chrom_features, len(features))) as pool:
+        return list(pool.map(score_bedgraph,
+                             [path for name, path in samples]))
+
+
+# Percent methylation and coverage (methylated + unmethylated) of each sample,
+# side by side. Percent methylation below --mincov, or without coverage, is NA.
+
+def percent_column(sums, mincov):
+    column = []
+    for nC, nT in sums.tolist():
+        if nC + nT and nC + nT >= mincov:
+            column.append(str(nC / (nC + nT) * 100))
+        else:
+            column.append('NA')
+    return column
+
+
+def output_matrix(features, samples, sample_sums, mincov, output_handle=stdout):
+    columns = []
+    for sums in sample_sums:
+        columns.append(percent_column(sums, mincov))
+        columns.append([str(coverage) for coverage in sums.sum(axis=1).tolist()])
+    header = ['chrom', 'start', 'end', 'name']
+    for name, path in samples:
+        header += [name + '.perc_met', name + '.coverage']
+    output_handle.write('\t'.join(header) + '\n')
+    for first in range(0, len(features), WRITE_LINES):
+        last = min(first + WRITE_LINES, len(features))
+        output_handle.write(''.join(
+            '\t'.join(features[i][0:4] + [column[i] for column in columns]) +
+            '\n' for i in range(first, last)))
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Calculate percent methylation and coverage over the '
+        'features of a .bed file for any number of MethylDackel bedGraph '
+        'files (samples and contexts), scored in parallel and written as one '
+        'feature by sample matrix.')
+    parser.add_argument('bedGraph',
+                        help='bedGraph files of methylation calls, named by '
+                        'file name',
+                        nargs='*',
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('-b', '--bed',
+                        help='bed file of features, four columns (chrom, '
+                        'start, end, name)',
+                        required=True,
+                        metavar='FILE.bed')
+    parser.add_argument('-s', '--sample_sheet',
+                        help='Tab-separated file of sample name and bedGraph '
+                        'path, one per line',
+                        metavar='FILE.tsv')
+    parser.add_argument('-m', '--mincov',
+                        help='Minimum coverage value to report methylation',
+                        default=0,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of bedGraph files to score at once '
+                        '(default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--sorted',
+                        help='Report features in the order given rather than '
+                        'sorted by chromosome and start',
+                        action='store_true')
+    parser.add_argument('-o', '--output',
+                        help='Output matrix (default=stdout)',
+                        metavar='FILE.tsv')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    samples = [(sample_name(path, BEDGRAPH_SUFFIXES), path)
+               for path in args.bedGraph]
+    if args.sample_sheet:
+        samples += read_sample_sheet(args.sample_sheet)
+    if not samples:
+        exit('Error: No bedGraph files given.')
+    names = [name for name, path in samples]
+    if len(set(names)) != len(names):
+        exit('Error: Sample names must be unique.')
+
+    print('Reading features .bed file: %s' % args.bed, file=stderr)
+    features = read_features(args.bed, args.sorted)
+
+    print('Scoring %s bedGraph files...' % len(samples), file=stderr)
+    sample_sums = score_samples(samples, features, args.jobs)
+
+    if args.output:
+        with open(args.output, 'w') as output_handle:
+            output_matrix(features, samples, sample_sums, args.mincov,
+                          output_handle)
+    else:
+        output_matrix(features, samples, sample_sums, args.mincov)
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Calculate percent methylation in fixed-size tiles along the genome
+# from MethylDackel bedGraph files
+# Created: 2026-10-17
+# Depends: numpy
+
+import numpy as np
+from argparse import ArgumentParser
+from sys import exit
+from bedgraph_io import bedgraph_chunks, map_bedgraphs
+from bedgraph_methylation_by_bed import calc_methylation
+
+
+def add_tiles(tiles, counts):
+    if tiles is None:
+        return counts
+    if len(counts) > len(tiles):
+        counts[:len(tiles)] += tiles
+        return counts
+    tiles[:len(counts)] += counts
+    return tiles
+
+
+# Chromosome lengths from the first two columns of a chrom.sizes or .fai file
+
+def read_chrom_sizes(sizes_file):
+    chrom_sizes = {}
+    with open(sizes_file, 'r') as input_handle:
+        for line in input_handle:
+            entry = line.split()
+            if entry and not entry[0].startswith('#'):
+                chrom_sizes[entry[0]] = int(entry[1])
+    return chrom_sizes
+
+
+# Number of sites and their methylated and unmethylated counts in each tile of
+# each chromosome, binned on site start a chunk at a time, in any input order,
+# with the last site end of each chromosome. Counts are summed as integers.
+
+def tile_sums(input_bedgraph, tile_size):
+    chrom_tiles = {}
+    chrom_ends = {}
+    for chunk in bedgraph_chunks(input_bedgraph):
+        bins = chunk.column(1) // tile_size
+        ends, met, unmet = chunk.column(2), chunk.column(4), chunk.column(5)
+        for chrom, lines in chunk.chrom_groups():
+            chunk_bins = bins[lines]
+            counts = np.zeros((int(chunk_bins.max()) + 1, 3), dtype=np.int64)
+            np.add.at(counts[:, 0], chunk_bins, 1)
+            np.add.at(counts[:, 1], chunk_bins, met[lines])
+            np.add.at(counts[:, 2], chunk_bins, unmet[lines])
+            chrom_tiles[chrom] = add_tiles(chrom_tiles.get(chrom), counts)
+            chrom_ends[chrom] = max(chrom_ends.get(chrom, 0),
+                                    int(ends[lines].max()))
+    return chrom_tiles, chrom_ends
+
+
+# One track per context, of the tiles holding at least one site, with the
+# same --mincov rule and output as bedgraph_methylation_by_bed.py. The last
+# tile of a chromosome ends at its length, or at its last site when the length
+# is not known.
+
+def write_tile_track(input_bedgraph, output_file, tile_size, mincov,
+                     chrom_sizes=None):
+    chrom_tiles, chrom_ends = tile_sums(input_bedgraph, tile_size)
+    with open(output_file, 'w') as output_handle:
+        for chrom, tiles in chrom_tiles.items():
+            chrom_length = (chrom_sizes or {}).get(chrom, chrom_ends[chrom])
+            occupied = np.flatnonzero(tiles[:, 0])
+            tile_starts = occupied * tile_size
+            tile_ends = np.minimum(tile_starts + tile_size, chrom_length)
+            calc_methylation(([chrom, str(start), str(end)] for start, end in
+                              zip(tile_starts.tolist(), tile_ends.tolist())),
+                             tiles[occupied, 1:], mincov, output_handle)
+    return output_file
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Calculate percent methylation in fixed-size tiles along '
+        'the genome from a set of MethylDackel bedGraph files, writing one '
+        'track per context.')
+    parser.add_argument('--CG',
+                        help='CG context bedGraph',
+                        default=None,
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('--CHG',
+                        help='CHG context bedGraph',
+                        default=None,
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('--CHH',
+                        help='CHH context bedGraph',
+                        default=None,
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('-t', '--tile_size',
+                        help='Tile size in bp (default=100)',
+                        default=100,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-c', '--chrom_sizes',
+                        help='chrom.sizes or .fasta.fai file; the last tile '
+                        'of each chromosome ends at its length (default=the '
+                        'end of its last site)',
+                        default=None,
+                        metavar='FILE')
+    parser.add_argument('-m', '--mincov',
+                        help='Minimum coverage value to report methylation',
+                        default=0,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-o', '--output_prefix',
+                        help='Write PREFIX.CONTEXT.bedGraph for each context',
+                        required=True,
+                        metavar='PREFIX')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of context files to tile at once '
+                        '(default=3)',
+                        default=3,
+                        type=int,
+                        metavar='INT')
+    return parser.parse_args()
+
+
+# Process the files
+
+def main(args):
+    contexts = [(context, input_bedgraph) for context, input_bedgraph in
+                (('CG', args.CG), ('CHG', args.CHG), ('CHH', args.CHH))
+                if input_bedgraph]
+    if not contexts:
+        exit('Error: No bedGraph files given.')
+    if args.tile_size < 1:
+        exit('Error: --tile_size must be positive.')
+    chrom_sizes = (read_chrom_sizes(args.chrom_sizes) if args.chrom_sizes
+                   else None)
+    map_bedgraphs(write_tile_track,
+                  [input_bedgraph for context, input_bedgraph in contexts],
+                  args.jobs,
+                  ['%s.%s.bedGraph' % (args.output_prefix, context)
+                   for context, input_bedgraph in contexts],
+                  [args.tile_size] * len(contexts),
+                  [args.mincov] * len(contexts),
+                  [chrom_sizes] * len(contexts))
+
+
+if __name__ == '__main__':
+    main(get_args())
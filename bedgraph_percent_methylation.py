@@ -3,28 +3,42 @@
 # Author: Jeffrey Grover
 # Purpose: Calculate percent methylation from MethylDackel bedGraph files
 # Created: 2019-04-29
+# Depends: numpy
 
-import gzip
 from argparse import ArgumentParser
 from sys import exit
+from bedgraph_io import bedgraph_chrom_totals, map_bedgraphs, sum_totals
 
 
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
+def percent(count, other_count):
+    try:
+        return count / (count + other_count) * 100
+    except ZeroDivisionError:
+        return 'NA'
 
 
-def methyl_calc(input_bedgraph):
-    met_c = 0
-    unmet_c = 0
-    with magic_open(input_bedgraph) as input_handle:
-        next(input_handle)  # Skip header
-        for line in input_handle:
-            met_c += int(line.split()[4])
-            unmet_c += int(line.split()[5])
-    return (met_c / (met_c + unmet_c)) * 100
+# Per-chromosome table from the totals of each context: methylated and total
+# counts and percent methylation per context, and the conversion rate
+# (unmethylated over total, all contexts pooled)
+
+def output_chrom_table(contexts, context_totals, output_handle):
+    chroms = []
+    for chrom_totals in context_totals:
+        chroms += [chrom for chrom in chrom_totals if chrom not in chroms]
+    header = ['chrom']
+    for context in contexts:
+        header += [context + '.met', context + '.total', context + '.perc_met']
+    print(*header, 'conversion_rate', sep='\t', file=output_handle)
+    for chrom in chroms:
+        row = [chrom]
+        met_c = unmet_c = 0
+        for chrom_totals in context_totals:
+            chrom_met, chrom_unmet = chrom_totals.get(chrom, (0, 0))
+            row += [chrom_met, chrom_met + chrom_unmet,
+                    percent(chrom_met, chrom_unmet)]
+            met_c += chrom_met
+            unmet_c += chrom_unmet
+        print(*row, percent(unmet_c, met_c), sep='\t', file=output_handle)
 
 
 # Command line parser
@@ -45,6 +59,16 @@ def get_args():
                         help='CHH context bedGraph',
                         default=None,
                         metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('-c', '--by_chrom',
+                        help='Also write per-chromosome methylation and '
+                        'conversion rates to this file',
+                        metavar='FILE.tsv')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of context files to read at once '
+                        '(default=3)',
+                        default=3,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
@@ -53,15 +77,20 @@ def get_args():
 def main(args):
     if not args.CG and not args.CHG and not args.CHH:
         exit('Without data how do you expect to do anything!')
-    if args.CG:
-        cg_methylation = methyl_calc(args.CG)
-        print('CG', cg_methylation, sep='\t')
-    if args.CHG:
-        chg_methylation = methyl_calc(args.CHG)
-        print('CHG', chg_methylation, sep='\t')
-    if args.CHH:
-        chh_methylation = methyl_calc(args.CHH)
-        print('CHH', chh_methylation, sep='\t')
+    contexts = [(context, input_bedgraph) for context, input_bedgraph in
+                (('CG', args.CG), ('CHG', args.CHG), ('CHH', args.CHH))
+                if input_bedgraph]
+    context_totals = map_bedgraphs(
+        bedgraph_chrom_totals,
+        [input_bedgraph for context, input_bedgraph in contexts], args.jobs)
+    for (context, input_bedgraph), chrom_totals in zip(contexts,
+                                                       context_totals):
+        met_c, unmet_c = sum_totals(chrom_totals)
+        print(context, (met_c / (met_c + unmet_c)) * 100, sep='\t')
+    if args.by_chrom:
+        with open(args.by_chrom, 'w') as output_handle:
+            output_chrom_table([context for context, input_bedgraph
+                                in contexts], context_totals, output_handle)
 
 
 if __name__ == '__main__':
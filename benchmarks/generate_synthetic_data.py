@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Generate deterministic synthetic inputs (genome .fasta, small RNA
+# .fastq.gz, sorted and indexed .bam, MethylDackel CG/CHG/CHH .bedGraphs,
+# feature .bed and mosdepth per-base coverage) for benchmarking the scripts
+# Created: 2026-10-17
+# Depends: numpy, pysam
+
+import gzip
+import json
+import pysam
+import numpy as np
+from argparse import ArgumentParser
+from os import makedirs
+from os.path import join
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+COMPLEMENT = bytes.maketrans(b'ACGT', b'TGCA')
+
+# Small RNA length distribution with the 21, 22 and 24 nt siRNA peaks
+READ_LENGTHS = np.arange(18, 36)
+LENGTH_WEIGHTS = np.array([2, 3, 6, 20, 14, 6, 30, 5, 3, 2, 2, 1, 1, 1, 1, 1,
+                           1, 1], dtype=np.float64)
+LENGTH_WEIGHTS /= LENGTH_WEIGHTS.sum()
+
+
+def chromosome_sizes(genome_size, n_chromosomes):
+    weights = np.arange(n_chromosomes, 0, -1, dtype=np.float64)
+    sizes = (weights / weights.sum() * genome_size).astype(np.int64)
+    return {'chr%s' % (i + 1): int(size) for i, size in enumerate(sizes)}
+
+
+def make_genome(rng, sizes):
+    return {chrom: BASES[rng.integers(0, 4, size)].tobytes()
+            for chrom, size in sizes.items()}
+
+
+def write_fasta(genome, output_file, width=60):
+    with open(output_file, 'wb') as output_handle:
+        for chrom, sequence in genome.items():
+            output_handle.write(b'>' + chrom.encode() + b'\n')
+            for start in range(0, len(sequence), width):
+                output_handle.write(sequence[start:start + width] + b'\n')
+
+
+# Reads come from a limited set of loci so that sequences repeat, as they do
+# in real small RNA libraries. Returns the reads sorted by position.
+
+def make_reads(rng, genome, n_reads, n_loci):
+    chroms = list(genome)
+    sizes = np.array([len(genome[chrom]) for chrom in chroms])
+    locus_chrom = rng.choice(len(chroms), n_loci, p=sizes / sizes.sum())
+    locus_start = (rng.random(n_loci) * (sizes[locus_chrom] - 40)).astype(np.int64)
+    locus_strand = rng.random(n_loci) < 0.5
+    locus_weight = 1 / np.arange(1, n_loci + 1) ** 1.1
+    locus = rng.choice(n_loci, n_reads, p=locus_weight / locus_weight.sum())
+    lengths = rng.choice(READ_LENGTHS, n_reads, p=LENGTH_WEIGHTS)
+    order = np.lexsort((locus_start[locus], locus_chrom[locus]))
+    for i in order.tolist():
+        chrom = chroms[locus_chrom[locus[i]]]
+        start = int(locus_start[locus[i]])
+        length = int(lengths[i])
+        yield chrom, start, length, bool(locus_strand[locus[i]])
+
+
+def read_sequence(genome, chrom, start, length, reverse):
+    sequence = genome[chrom][start:start + length]
+    if reverse:
+        sequence = sequence.translate(COMPLEMENT)[::-1]
+    return sequence
+
+
+def write_fastq(genome, reads, output_file, seed):
+    order = np.random.default_rng(seed).permutation(len(reads))
+    with gzip.open(output_file, 'wb', compresslevel=1) as output_handle:
+        for n, i in enumerate(order.tolist()):
+            chrom, start, length, reverse = reads[i]
+            sequence = read_sequence(genome, chrom, start, length, reverse)
+            output_handle.write(b'@read%d\n%s\n+\n%s\n' % (
+                n, sequence, b'I' * length))
+
+
+def write_bam(genome, reads, output_file):
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': chrom, 'LN': len(sequence)}
+                     for chrom, sequence in genome.items()]}
+    chrom_ids = {chrom: i for i, chrom in enumerate(genome)}
+    with pysam.AlignmentFile(output_file, 'wb', header=header) as output_handle:
+        for n, (chrom, start, length, reverse) in enumerate(reads):
+            aln = pysam.AlignedSegment(output_handle.header)
+            aln.query_name = 'read%d' % n
+            aln.query_sequence = genome[chrom][start:start + length].decode()
+            aln.flag = 16 if reverse else 0
+            aln.reference_id = chrom_ids[chrom]
+            aln.reference_start = start
+            aln.mapping_quality = 255
+            aln.cigarstring = '%dM' % length
+            aln.query_qualities = pysam.qualitystring_to_array('I' * length)
+            output_handle.write(aln)
+    pysam.index(output_file)
+
+
+# MethylDackel style bedGraphs: a track line then chrom, start, end, percent,
+# methylated and unmethylated counts for each cytosine in the context
+
+def write_bedgraphs(rng, genome, n_sites, output_prefix):
+    context_sites = {'CpG': n_sites // 10, 'CHG': n_sites // 5,
+                     'CHH': n_sites - n_sites // 10 - n_sites // 5}
+    context_levels = {'CpG': 0.8, 'CHG': 0.4, 'CHH': 0.05}
+    sizes = np.array([len(sequence) for sequence in genome.values()])
+    output_files = {}
+    for context, n in context_sites.items():
+        output_file = '%s_%s.bedGraph' % (output_prefix, context)
+        output_files[context] = output_file
+        with open(output_file, 'w') as output_handle:
+            print('track type="bedGraph" description="synthetic %s"' % context,
+                  file=output_handle)
+            per_chrom = rng.multinomial(n, sizes / sizes.sum())
+            for (chrom, sequence), n_chrom in zip(genome.items(), per_chrom):
+                starts = np.unique(rng.integers(0, len(sequence) - 1, n_chrom))
+                depth = rng.integers(1, 30, len(starts))
+                methylated = rng.binomial(depth, context_levels[context])
+                unmethylated = depth - methylated
+                percent = (100 * methylated / depth).astype(np.int64)
+                for row in zip(starts.tolist(), percent.tolist(),
+                               methylated.tolist(), unmethylated.tolist()):
+                    print(chrom, row[0], row[0] + 1, *row[1:], sep='\t',
+                          file=output_handle)
+    return output_files
+
+
+def write_features_bed(rng, genome, n_features, output_file):
+    with open(output_file, 'w') as output_handle:
+        for i in range(n_features):
+            chrom = list(genome)[int(rng.integers(0, len(genome)))]
+            length = int(rng.integers(100, 5000))
+            start = int(rng.integers(0, max(len(genome[chrom]) - length, 1)))
+            print(chrom, start, start + length, 'feature%d' % i, sep='\t',
+                  file=output_handle)
+
+
+# mosdepth per-base output: runs of equal depth covering every chromosome
+
+def write_mosdepth(rng, genome, output_file):
+    with gzip.open(output_file, 'wt', compresslevel=1) as output_handle:
+        for chrom, sequence in genome.items():
+            start = 0
+            while start < len(sequence):
+                end = min(start + int(rng.integers(1, 200)), len(sequence))
+                print(chrom, start, end, int(rng.poisson(10)), sep='\t',
+                      file=output_handle)
+                start = end
+
+
+def generate(output_dir, genome_size=5000000, n_chromosomes=5,
+             n_reads=1000000, n_sites=1000000, n_features=10000, seed=1):
+    makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    genome = make_genome(rng, chromosome_sizes(genome_size, n_chromosomes))
+    files = {'fasta': join(output_dir, 'genome.fasta'),
+             'fastq': join(output_dir, 'reads.fastq.gz'),
+             'bam': join(output_dir, 'reads.bam'),
+             'bed': join(output_dir, 'features.bed'),
+             'mosdepth': join(output_dir, 'coverage.per-base.bed.gz')}
+    write_fasta(genome, files['fasta'])
+    reads = list(make_reads(rng, genome, n_reads, max(n_reads // 20, 1)))
+    write_fastq(genome, reads, files['fastq'], seed)
+    write_bam(genome, reads, files['bam'])
+    bedgraphs = write_bedgraphs(rng, genome, n_sites,
+                                join(output_dir, 'methylation'))
+    files.update({'bedgraph_' + context: path
+                  for context, path in bedgraphs.items()})
+    write_features_bed(rng, genome, n_features, files['bed'])
+    write_mosdepth(rng, genome, files['mosdepth'])
+    manifest = {'seed': seed, 'genome_size': genome_size,
+                'chromosomes': n_chromosomes, 'reads': n_reads,
+                'sites': n_sites, 'features': n_features, 'files': files}
+    with open(join(output_dir, 'manifest.json'), 'w') as output_handle:
+        json.dump(manifest, output_handle, indent=2)
+    return manifest
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Generate deterministic synthetic inputs for benchmarking.')
+    parser.add_argument('output_dir',
+                        help='Directory to write the synthetic data to',
+                        metavar='DIR')
+    parser.add_argument('-g', '--genome_size',
+                        help='Total genome size in bp (default=5000000)',
+                        default=5000000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-c', '--chromosomes',
+                        help='Number of chromosomes (default=5)',
+                        default=5,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-r', '--reads',
+                        help='Number of small RNA reads (default=1000000)',
+                        default=1000000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-s', '--sites',
+                        help='Number of methylation sites over all contexts '
+                        '(default=1000000)',
+                        default=1000000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-f', '--features',
+                        help='Number of .bed features (default=10000)',
+                        default=10000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--seed',
+                        help='Random seed (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    generate(args.output_dir, args.genome_size, args.chromosomes, args.reads,
+             args.sites, args.features, args.seed)
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Time every script on synthetic inputs and record wall time,
+# throughput and peak memory as JSON for tracking regressions
+# Created: 2026-10-17
+# Depends: numpy, pysam
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from os.path import abspath, dirname, exists, join
+from generate_synthetic_data import generate
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+
+
+# Each benchmark is a name, the script, its arguments (with {placeholders}
+# filled from the manifest files and the scratch directory) and the manifest
+# count its throughput is measured in
+
+def benchmark_commands(files, scratch_dir):
+    paths = dict(files, scratch=scratch_dir)
+    commands = [
+        ('fastq_readlength_profile', 'fastq_readlength_profile.py',
+         ['{fastq}'], 'reads'),
+        ('fastq_end_bias', 'fastq_end_bias.py',
+         ['{fastq}', '-n', '18', '-m', '30'], 'reads'),
+        ('fastq_nucleotide_freq_by_position',
+         'fastq_nucleotide_freq_by_position.py', ['{fastq}', '-l', '21'],
+         'reads'),
+        ('fastq_unique_seqs', 'fastq_unique_seqs.py',
+         ['{fastq}', '-n', '18', '-m', '30'], 'reads'),
+        ('fastq_length_filter', 'fastq_length_filter.py',
+         ['{fastq}', '-n', '21', '-m', '24'], 'reads'),
+        ('fastq_multi_profile', 'fastq_multi_profile.py',
+         ['{fastq}', '-o', '{scratch}/multi', '--lengths', '--end_bias',
+          '--position_length', '21', '--unique'], 'reads'),
+        ('bam_readlength_profile', 'bam_readlength_profile.py',
+         ['{bam}', '-n', '18', '-m', '30'], 'reads'),
+        ('bam_window_tracks', 'bam_readlength_profile.py',
+         ['{bam}', '-w', '100', '--step', '50'], 'reads'),
+        ('bam_readlength_profile_by_bed', 'bam_readlength_profile_by_bed.py',
+         ['{bam}', '-b', '{bed}', '-n', '18', '-m', '30'], 'reads'),
+        ('bam_unique_seqs', 'bam_unique_seqs.py',
+         ['{bam}', '-n', '18', '-m', '30'], 'reads'),
+        ('bedgraph_percent_methylation', 'bedgraph_percent_methylation.py',
+         ['--CG', '{bedgraph_CpG}', '--CHG', '{bedgraph_CHG}', '--CHH',
+          '{bedgraph_CHH}'], 'sites'),
+        ('bedgraph_bisulfite_conv_calc', 'bedgraph_bisulfite_conv_calc.py',
+         ['--CG', '{bedgraph_CpG}', '--CHG', '{bedgraph_CHG}', '--CHH',
+          '{bedgraph_CHH}'], 'sites'),
+        ('bedgraph_methylation_by_bed', 'bedgraph_methylation_by_bed.py',
+         ['-b', '{bed}', '-g', '{bedgraph_CHH}'], 'sites'),
+        ('bedgraph_methylation_tiles', 'bedgraph_methylation_tiles.py',
+         ['--CG', '{bedgraph_CpG}', '--CHG', '{bedgraph_CHG}', '--CHH',
+          '{bedgraph_CHH}', '-t', '100', '-o', '{scratch}/tiles'], 'sites'),
+        ('bedgraph_methylation_matrix', 'bedgraph_methylation_matrix.py',
+         ['-b', '{bed}', '{bedgraph_CpG}', '{bedgraph_CHG}', '{bedgraph_CHH}',
+          '-j', '3'], 'sites'),
+        ('bed_sort', 'bed_sort.py',
+         ['{bed}', '-o', '{scratch}/features.sorted.bed'], 'features'),
+        ('fasta_getseq_by_bed', 'fasta_getseq_by_bed.py',
+         ['{fasta}', '-b', '{bed}'], 'features'),
+        ('bed_coverage_to_x_coverage', 'bed_coverage_to_x_coverage.py',
+         ['-f', '{fasta}', '-m', '{mosdepth}'], 'genome_size'),
+    ]
+    return [(name, script, [arg.format(**paths) for arg in args], unit)
+            for name, script, args, unit in commands]
+
+
+# Linux carries the parent's resident size over to a forked child's peak RSS,
+# so each command is run under a small Python launcher that records the peak
+# RSS of its own child (RUSAGE_CHILDREN) to a file. The launcher is only about
+# 10 MB, which is the floor on any measurement.
+
+MEASURE_RSS = (
+    'import resource, subprocess, sys\n'
+    'code = subprocess.call(sys.argv[2:])\n'
+    'with open(sys.argv[1], "w") as output_handle:\n'
+    '    output_handle.write(str(resource.getrusage('
+    'resource.RUSAGE_CHILDREN).ru_maxrss))\n'
+    'sys.exit(code)\n')
+
+
+# Run one command, returning wall time, peak RSS of the command in KB and the
+# exit code
+
+def run_command(command, rss_file, log_handle):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', MEASURE_RSS, rss_file] +
+                             command, cwd=REPO_DIR, stdout=subprocess.DEVNULL,
+                             stderr=log_handle)
+    elapsed = time.perf_counter() - start
+    with open(rss_file) as input_handle:
+        peak_rss = int(input_handle.read())
+    return elapsed, peak_rss, process.returncode
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run_benchmarks(manifest, scratch_dir, repeat=3, only=None):
+    results = []
+    log_file = join(scratch_dir, 'benchmark_stderr.log')
+    rss_file = join(scratch_dir, 'peak_rss.txt')
+    with open(log_file, 'w') as log_handle:
+        for name, script, args, unit in benchmark_commands(manifest['files'],
+                                                           scratch_dir):
+            if only and name not in only:
+                continue
+            command = [sys.executable, join(REPO_DIR, script)] + args
+            runs = [run_command(command, rss_file, log_handle) for i in range(repeat)]
+            best = min(elapsed for elapsed, rss, code in runs)
+            results.append({
+                'benchmark': name,
+                'command': [script] + args,
+                'seconds': [elapsed for elapsed, rss, code in runs],
+                'best_seconds': best,
+                'throughput_unit': '%s/s' % unit,
+                'throughput': manifest[unit] / best if best else None,
+                'peak_rss_kb': max(rss for elapsed, rss, code in runs),
+                'exit_codes': [code for elapsed, rss, code in runs],
+            })
+            print('%-36s %8.2f s %12.0f %s %8d KB%s' % (
+                name, best, results[-1]['throughput'] or 0,
+                results[-1]['throughput_unit'], results[-1]['peak_rss_kb'],
+                '' if not any(results[-1]['exit_codes']) else '  FAILED'),
+                file=sys.stderr)
+    return results
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Benchmark the scripts on deterministic synthetic data '
+        'and write the results as JSON.')
+    parser.add_argument('-d', '--data_dir',
+                        help='Directory holding synthetic data, generated '
+                        'there first if it has no manifest.json',
+                        required=True,
+                        metavar='DIR')
+    parser.add_argument('-o', '--output',
+                        help='Output .json file of results',
+                        required=True,
+                        metavar='FILE.json')
+    parser.add_argument('-n', '--repeat',
+                        help='Runs of each benchmark, the fastest is used for '
+                        'throughput (default=3)',
+                        default=3,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-b', '--benchmark',
+                        help='Only run this benchmark, may be given several '
+                        'times',
+                        action='append',
+                        metavar='NAME')
+    parser.add_argument('-r', '--reads',
+                        help='Reads to generate if data is missing '
+                        '(default=1000000)',
+                        default=1000000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-s', '--sites',
+                        help='Methylation sites to generate if data is missing '
+                        '(default=1000000)',
+                        default=1000000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-g', '--genome_size',
+                        help='Genome size to generate if data is missing '
+                        '(default=5000000)',
+                        default=5000000,
+                        type=int,
+                        metavar='INT')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    manifest_file = join(args.data_dir, 'manifest.json')
+    if exists(manifest_file):
+        with open(manifest_file) as input_handle:
+            manifest = json.load(input_handle)
+    else:
+        print('Generating synthetic data in %s' % args.data_dir, file=sys.stderr)
+        manifest = generate(args.data_dir, genome_size=args.genome_size,
+                            n_reads=args.reads, n_sites=args.sites)
+    scratch_dir = join(args.data_dir, 'scratch')
+    os.makedirs(scratch_dir, exist_ok=True)
+    results = {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'inputs': manifest,
+        'benchmarks': run_benchmarks(manifest, scratch_dir, args.repeat,
+                                     args.benchmark),
+    }
+    with open(args.output, 'w') as output_handle:
+        json.dump(results, output_handle, indent=2)
+
+
+if __name__ == '__main__':
+    main(get_args())
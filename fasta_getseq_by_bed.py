@@ -3,54 +3,127 @@
 # Author: Jeffrey Grover
 # Purpose: Pull sequences from a fasta file based on coordinates in a bed file
 # Created: 2019-06-13
+# Depends: numpy
 
 from argparse import ArgumentParser
-from itertools import groupby
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from sys import exit, stdout
+from fasta_io import IndexedFasta
+from fastq_io import BlockWriter
 
-# Subroutine functions
+BATCH_FEATURES = 10000  # Features formatted per worker task
+
+# Complement of IUPAC nucleotide codes, case kept; S, W and anything else are
+# left as they are
+COMPLEMENT = bytes.maketrans(b'ACGTRYKMBVDHacgtrykmbvdh',
+                             b'TGCAYRMKVBHDtgcayrmkvbhd')
+
+# The .fasta opened once per worker process, when it starts
+worker_fasta = None
 
+# Subroutine functions
 
-def fasta_iterate(fasta_file):
-    with open(fasta_file, 'r') as input_handle:
-        fasta_reader = (
-            x[1] for x in groupby(input_handle, lambda line: line.startswith('>'))
-        )
-        for header in fasta_reader:
-            chromosome = next(header).strip('>').strip()
-            seq = ''.join(s.strip() for s in next(fasta_reader))
-            yield (chromosome, seq)
 
+# Features in file order as (chromosome, start, end, ID, strand), 0-based and
+# half-open. Duplicate IDs are kept. Strand is column 6 when present, + if not.
 
-def parse_bed_to_dict(bed_file):
-    bed_dict = {}
+def read_bed_features(bed_file):
+    features = []
     with open(bed_file, 'r') as input_handle:
         for line in input_handle:
-            entry = line.strip().split('\t')
-            chromosome = entry[0]
-            start = int(entry[1])
-            stop = int(entry[2]) - 1  # To convert from half-open coordinates
-            feature_id = entry[3]
-            if chromosome not in bed_dict:
-                bed_dict[chromosome] = {}
-            bed_dict[chromosome][feature_id] = (start, stop)
-    return bed_dict
-
-
-def wrap_text(text, width=80):
-    for s in range(0, len(text), width):
-        yield text[s:s+width]
-
-
-def output_sequences_as_fasta(fasta_iterator, bed_dict):
-    for chromosome, sequence in fasta_iterator:
-        if chromosome in bed_dict:
-            for feature_id in bed_dict[chromosome]:
-                start = bed_dict[chromosome][feature_id][0]
-                stop = bed_dict[chromosome][feature_id][1]
-                header = '>%s:%s-%s_%s' % (chromosome, start + 1, stop + 1, feature_id)
-                print(header, sep='\n')
-                for line in wrap_text(sequence[start:stop]):
-                    print(line)
+            if not line.strip() or line.startswith(('track', 'browser', '#')):
+                continue
+            entry = line.rstrip('\n').split('\t')
+            strand = entry[5] if len(entry) > 5 and entry[5] == '-' else '+'
+            features.append((entry[0], int(entry[1]), int(entry[2]), entry[3],
+                             strand))
+    return features
+
+
+def feature_batches(features, batch_size=BATCH_FEATURES):
+    for first in range(0, len(features), batch_size):
+        yield features[first:first + batch_size]
+
+
+def wrap_sequence(sequence, width=80):
+    return b'\n'.join(sequence[s:s + width]
+                      for s in range(0, len(sequence), width))
+
+
+# Widen a feature by its flanks, upstream being before the start on + and
+# after the end on -, clipped to the chromosome
+
+def flanked_region(start, end, strand, length, upstream, downstream):
+    if strand == '-':
+        upstream, downstream = downstream, upstream
+    return max(start - upstream, 0), min(end + downstream, length)
+
+
+# One block of .fasta records for a batch of features. Features on missing
+# chromosomes are skipped. With stranded, - features are reverse complemented
+# and the strand is added to the header.
+
+def format_features(features, upstream=0, downstream=0, stranded=False,
+                    width=80):
+    records = []
+    for chromosome, start, end, feature_id, strand in features:
+        if chromosome not in worker_fasta.index:
+            continue
+        start, end = flanked_region(start, end, strand if stranded else '+',
+                                    worker_fasta.index[chromosome][0],
+                                    upstream, downstream)
+        sequence = worker_fasta.fetch(chromosome, start, end)
+        if stranded:
+            if strand == '-':
+                sequence = sequence.translate(COMPLEMENT)[::-1]
+            header = '>%s:%s-%s(%s)_%s' % (chromosome, start + 1, end, strand,
+                                           feature_id)
+        else:
+            header = '>%s:%s-%s_%s' % (chromosome, start + 1, end, feature_id)
+        records.append(header.encode())
+        if sequence:
+            records.append(wrap_sequence(sequence, width))
+    records.append(b'')
+    return b'\n'.join(records) if len(records) > 1 else b''
+
+
+def init_worker(fasta_file):
+    global worker_fasta
+    worker_fasta = IndexedFasta(fasta_file)
+
+
+# Batches are formatted in a process pool, each worker holding its own view of
+# the .fasta, and come back in file order. Only a few batches per worker are
+# in flight at once, so output is never held for the whole .bed.
+
+def extract_sequences(fasta_file, features, jobs=1, *format_args):
+    if jobs <= 1:
+        init_worker(fasta_file)
+        for batch in feature_batches(features):
+            yield format_features(batch, *format_args)
+        worker_fasta.close()
+        return
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(fasta_file,)) as pool:
+        pending = deque()
+        for batch in feature_batches(features):
+            pending.append(pool.submit(format_features, batch, *format_args))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def output_sequences_as_fasta(blocks, output_file=None):
+    if output_file:
+        with BlockWriter(output_file, output_file.endswith('.gz')) as writer:
+            for block in blocks:
+                writer.write(block)
+    else:
+        for block in blocks:
+            stdout.buffer.write(block)
+        stdout.buffer.flush()
 
 
 # CLI argument parser
@@ -59,15 +132,51 @@ def output_sequences_as_fasta(fasta_iterator, bed_dict):
 def get_args():
     parser = ArgumentParser(
         description='Pull sequences from a .fasta file based on coordinates, '
-        'using a bed file as input.'
+        'using a bed file as input. Sequences are written in the order of the '
+        '.bed file.'
     )
     parser.add_argument('fasta',
-                        help='Input .fasta file to use as a reference',
-                        metavar='FILE.fasta')
+                        help='Input .fasta file to use as a reference, plain '
+                        'or bgzip-compressed; a .fai (and .gzi) index is '
+                        'built next to it if missing',
+                        metavar='FILE.fasta(.gz)')
     parser.add_argument('-b', '--bed',
                         help='Input .bed file with at least 4 columns; '
-                        'chromosome, start, stop, and ID.',
+                        'chromosome, start, stop, and ID. Strand is read from '
+                        'column 6.',
+                        required=True,
                         metavar='FILE.bed')
+    parser.add_argument('-s', '--strand',
+                        help='Reverse complement features on the - strand and '
+                        'put the strand in the header',
+                        action='store_true')
+    parser.add_argument('-u', '--upstream',
+                        help='Bases of flanking sequence to add upstream '
+                        '(default=0)',
+                        default=0,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-d', '--downstream',
+                        help='Bases of flanking sequence to add downstream '
+                        '(default=0)',
+                        default=0,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-w', '--width',
+                        help='Sequence line width (default=80)',
+                        default=80,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-j', '--jobs',
+                        help='Worker processes formatting sequences '
+                        '(default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-o', '--output',
+                        help='Output .fasta, gzipped if it ends in .gz '
+                        '(default=stdout)',
+                        metavar='FILE.fasta')
     return parser.parse_args()
 
 
@@ -75,8 +184,19 @@ def get_args():
 
 
 def main(args):
-    bed_dict = parse_bed_to_dict(args.bed)
-    output_sequences_as_fasta(fasta_iterate(args.fasta), bed_dict)
+    if args.upstream < 0 or args.downstream < 0:
+        exit('Error: Flanks must not be negative.')
+    if args.width < 1:
+        exit('Error: --width must be positive.')
+    features = read_bed_features(args.bed)
+    try:
+        IndexedFasta(args.fasta).close()
+    except ValueError as error:
+        exit('Error: %s' % error)
+    output_sequences_as_fasta(
+        extract_sequences(args.fasta, features, args.jobs, args.upstream,
+                          args.downstream, args.strand, args.width),
+        args.output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Random access to plain or bgzip-compressed .fasta files through
+# samtools-compatible .fai (and .gzi) indexes
+# Created: 2026-10-17
+# Depends: numpy
+
+import mmap
+import zlib
+import numpy as np
+from os import getpid, replace
+from os.path import exists, getmtime
+from struct import pack, unpack
+from fastq_io import bgzf_batches, is_bgzf, magic_open
+
+
+# .fai index: name, length, offset of the first base, bases per line and bytes
+# per line, one sequence per line. Names are the first word of the header, as
+# in samtools. Every line of a sequence but the last must be the same length.
+
+def build_fai(fasta_file):
+    entries = []
+    with magic_open(fasta_file, 'rb') as input_handle:
+        offset = 0
+        name = None
+        for line in input_handle:
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append((name, length, seq_offset, line_bases,
+                                    line_width))
+                name = line[1:].split()[0].decode()
+                offset += len(line)
+                seq_offset = offset
+                length = line_bases = line_width = 0
+                short_line = False
+                continue
+            bases = len(line.rstrip(b'\r\n'))
+            if bases:
+                if line_bases == 0:
+                    line_bases, line_width = bases, len(line)
+                elif short_line or bases > line_bases:
+                    raise ValueError('Different line lengths in sequence %s'
+                                     % name)
+                length += bases
+            if bases < line_bases:
+                short_line = True
+            offset += len(line)
+        if name is not None:
+            entries.append((name, length, seq_offset, line_bases, line_width))
+    return entries
+
+
+def read_fai(fai_file):
+    entries = []
+    with open(fai_file, 'r') as input_handle:
+        for line in input_handle:
+            entry = line.rstrip('\n').split('\t')
+            entries.append((entry[0],) + tuple(int(x) for x in entry[1:5]))
+    return entries
+
+
+def write_fai(entries, fai_file):
+    temp_file = '%s.tmp%s' % (fai_file, getpid())
+    with open(temp_file, 'w') as output_handle:
+        for entry in entries:
+            print(*entry, sep='\t', file=output_handle)
+    replace(temp_file, fai_file)
+
+
+# Reuse FILE.fai when it is newer than the .fasta, otherwise build it and save
+# it if the directory is writable
+
+def fasta_index(fasta_file):
+    fai_file = fasta_file + '.fai'
+    if exists(fai_file) and getmtime(fai_file) >= getmtime(fasta_file):
+        return read_fai(fai_file)
+    entries = build_fai(fasta_file)
+    try:
+        write_fai(entries, fai_file)
+    except OSError:
+        pass
+    return entries
+
+
+# .gzi index of a bgzip file: the compressed and uncompressed offset of the
+# start of every block but the first (and the empty end-of-file block), after
+# a count, all little-endian uint64
+
+def build_gzi(fasta_file):
+    offsets = []
+    uncompressed_offset = 0
+    with open(fasta_file, 'rb') as input_handle:
+        for offset, size in bgzf_batches(fasta_file, 1):
+            input_handle.seek(offset + size - 4)
+            block_size = unpack('<I', input_handle.read(4))[0]
+            if offset and block_size:
+                offsets.append((offset, uncompressed_offset))
+            uncompressed_offset += block_size
+    return offsets
+
+
+def read_gzi(gzi_file):
+    with open(gzi_file, 'rb') as input_handle:
+        n_blocks = unpack('<Q', input_handle.read(8))[0]
+        return [tuple(pair) for pair in np.frombuffer(
+            input_handle.read(16 * n_blocks), dtype='<u8').reshape(-1, 2)
+            .tolist()]
+
+
+def write_gzi(offsets, gzi_file):
+    temp_file = '%s.tmp%s' % (gzi_file, getpid())
+    with open(temp_file, 'wb') as output_handle:
+        output_handle.write(pack('<Q', len(offsets)))
+        for offset, uncompressed_offset in offsets:
+            output_handle.write(pack('<QQ', offset, uncompressed_offset))
+    replace(temp_file, gzi_file)
+
+
+def gzi_index(fasta_file):
+    gzi_file = fasta_file + '.gzi'
+    if exists(gzi_file) and getmtime(gzi_file) >= getmtime(fasta_file):
+        offsets = read_gzi(gzi_file)
+    else:
+        offsets = build_gzi(fasta_file)
+        try:
+            write_gzi(offsets, gzi_file)
+        except OSError:
+            pass
+    return [(0, 0)] + offsets
+
+
+# A .fasta opened for random access. Plain files are memory-mapped; bgzip
+# files are read from the block holding the first wanted byte, keeping the
+# last span decompressed for nearby features. A feature's bytes are found from
+# the line layout in the .fai, so memory and time follow the sequence fetched,
+# not the genome.
+
+class IndexedFasta:
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        self.handle = open(fasta_file, 'rb')
+        self.bgzf = is_bgzf(fasta_file)
+        if not self.bgzf and fasta_file.endswith('gz'):
+            raise ValueError('Compressed .fasta must be bgzip-compressed for '
+                             'random access')
+        self.index = {entry[0]: entry[1:] for entry in fasta_index(fasta_file)}
+        if self.bgzf:
+            blocks = gzi_index(fasta_file)
+            self.block_offsets = np.array([block[0] for block in blocks])
+            self.block_starts = np.array([block[1] for block in blocks])
+            self.span = (0, b'')
+        else:
+            self.data = mmap.mmap(self.handle.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def references(self):
+        return list(self.index)
+
+    def read(self, first, last):
+        if not self.bgzf:
+            return self.data[first:last]
+        span_start, span = self.span
+        if not span_start <= first or last > span_start + len(span):
+            i = int(np.searchsorted(self.block_starts, first, 'right')) - 1
+            span_start = int(self.block_starts[i])
+            self.handle.seek(int(self.block_offsets[i]))
+            blocks = []
+            position = span_start
+            while position < last:
+                header = self.handle.read(18)
+                if len(header) < 18:
+                    break
+                block_size = unpack('<H', header[16:18])[0] + 1
+                block = self.handle.read(block_size - 18)
+                blocks.append(zlib.decompress(block[:-8], -15))
+                position += len(blocks[-1])
+            span = b''.join(blocks)
+            self.span = (span_start, span)
+        return span[first - span_start:last - span_start]
+
+    # Bases start to end (0-based, half-open) of a sequence, clipped to its
+    # length, without line breaks
+
+    def fetch(self, name, start, end):
+        length, offset, line_bases, line_width = self.index[name]
+        start, end = max(start, 0), min(end, length)
+        if start >= end:
+            return b''
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = (offset + (end - 1) // line_bases * line_width +
+                (end - 1) % line_bases + 1)
+        sequence = self.read(first, last)
+        if line_width > line_bases:
+            sequence = sequence.replace(b'\n', b'').replace(b'\r', b'')
+        return sequence
+
+    def close(self):
+        if not self.bgzf:
+            self.data.close()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -3,46 +3,98 @@
 # Author: Jeffrey Grover
 # Purpose: Profile nucleotide bias at ends of reads from a .fastq file
 # Created: 2019-08-09
+# Depends: numpy
 
-import gzip
 from argparse import ArgumentParser
+from sys import exit, stderr, stdout
+import numpy as np
+from fastq_io import (get_samples, profile_samples, scan_fastq,
+                      scan_fastq_sampled)
+from profile_sampling import interval_rows
 
 
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
+BASES = 'ATCG'
+ENDS = ('5_prime', '3_prime')
+
+
+class EndBias:
+    def __init__(self, min_length, max_length):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.counts = np.zeros((2, 256), dtype=np.int64)  # 5' and 3' by byte
+
+    def add(self, sequence):
+        if sequence and self.min_length <= len(sequence) <= self.max_length:
+            self.counts[0, ord(sequence[0])] += 1
+            self.counts[1, ord(sequence[-1])] += 1
+
+    def add_chunk(self, chunk):
+        lengths = chunk.lengths
+        keep = ((lengths >= max(self.min_length, 1)) &
+                (lengths <= self.max_length))
+        starts = chunk.seq_starts[keep]
+        ends = starts + lengths[keep] - 1
+        self.counts[0] += np.bincount(chunk.data[starts], minlength=256)
+        self.counts[1] += np.bincount(chunk.data[ends], minlength=256)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def sample_counts(self):
+        return self.counts[:, [ord(base) for base in BASES]]
 
+    def bias_dict(self):
+        return {end: {base: int(self.counts[i, ord(base)]) for base in BASES}
+                for i, end in enumerate(ENDS)}
 
-def fastq_yield_seqs(input_fastq):
-    with magic_open(input_fastq) as input_handle:
-        i = 0
-        for line in input_handle:
-            i += 1
-            if i == 2:
-                yield line.strip()
-            elif i == 4:
-                i = 0
+    def write(self, output_handle=stdout):
+        output_end_bias(self.bias_dict(), output_handle)
 
 
 def end_bias(fastq_seqs, min_length, max_length):
-    bias_dict = {'5_prime': {'A': 0, 'T': 0, 'C': 0, 'G': 0},
-                 '3_prime': {'A': 0, 'T': 0, 'C': 0, 'G': 0}}
+    bias = EndBias(min_length, max_length)
     for sequence in fastq_seqs:
-        if min_length <= len(sequence) <= max_length:
-            bias_dict['5_prime'][sequence[0]] += 1
-            bias_dict['3_prime'][sequence[-1]] += 1
-    return bias_dict
+        bias.add(sequence)
+    return bias.bias_dict()
+
+
+def output_end_bias(bias_dict, output_handle=stdout):
+    print('end', 'A', 'T', 'C', 'G', sep=',', file=output_handle)
+    for end, freq_dict in bias_dict.items():
+        line = [end]
+        for base, count in freq_dict.items():
+            line.append(str(count))
+        print(','.join(line), file=output_handle)
+
+
+def output_sampled_end_bias(bias, confidence, output_handle=stdout):
+    print('end', 'base', 'count', 'proportion', 'ci_low', 'ci_high', sep=',',
+          file=output_handle)
+    for end, counts in zip(ENDS, bias.sample_counts()):
+        for row in interval_rows(list(BASES), counts, confidence):
+            print(end, *row, sep=',', file=output_handle)
+
+
+def output_end_bias_matrix(sample_profiles, output_handle=stdout):
+    columns = [(end, base) for end in ENDS for base in BASES]
+    print(','.join(['sample'] + ['%s_%s' % column for column in columns]),
+          file=output_handle)
+    for name, bias in sample_profiles:
+        bias_dict = bias.bias_dict()
+        line = [name] + [str(bias_dict[end][base]) for end, base in columns]
+        print(','.join(line), file=output_handle)
 
 
 # Command line parser
 
 def get_args():
     parser = ArgumentParser(
-        description='Profile 3\' and 5\' nucleotide bias from .fastq file')
+        description='Profile 3\' and 5\' nucleotide bias from .fastq file. '
+        'Several files are profiled in parallel into one sample by base '
+        'matrix.')
     parser.add_argument('fastq',
                         help='Input .fastq, may be gzipped',
+                        nargs='*',
                         metavar='FILE.fastq(.gz)')
     parser.add_argument('-n', '--min_length',
                         help='Minimum length of reads to profile (default=0)',
@@ -54,21 +106,73 @@ def get_args():
                         default=150,
                         type=int,
                         metavar='INT')
+    parser.add_argument('-s', '--sample_sheet',
+                        help='Tab-separated file of sample name and .fastq(.gz) '
+                        'path, one sample per line',
+                        metavar='FILE.tsv')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of samples to profile at once (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--sample',
+                        help='Estimate the profile from a sample of reads, '
+                        'stopping once every proportion is within '
+                        '--tolerance, and report confidence intervals',
+                        action='store_true')
+    parser.add_argument('--tolerance',
+                        help='Largest confidence interval half-width accepted '
+                        'for each proportion when sampling (default=0.005)',
+                        default=0.005,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--confidence',
+                        help='Confidence level of the intervals (default=0.95)',
+                        default=0.95,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--stride',
+                        help='When sampling, profile every INT-th block of '
+                        'about 1 MB of reads; the default of 1 samples the '
+                        'start of the file, larger values spread the sample '
+                        'through it (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-t', '--threads',
+                        help='Worker processes for parsing; BGZF input is '
+                        'also decompressed in parallel (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
 # Main function entry point
 
 def main(args):
-    bias_dict = end_bias(
-        fastq_yield_seqs(args.fastq), args.min_length, args.max_length
-    )
-    print('end', 'A', 'T', 'C', 'G', sep=',')
-    for end, freq_dict in bias_dict.items():
-        line = [end]
-        for base, count in freq_dict.items():
-            line.append(str(count))
-        print(','.join(line))
+    try:
+        samples = get_samples(args.fastq, args.sample_sheet)
+    except ValueError as error:
+        exit('Error: %s' % error)
+    if not samples:
+        exit('Error: No input .fastq files given.')
+    bias = EndBias(args.min_length, args.max_length)
+    if args.sample and len(samples) == 1 and not args.sample_sheet:
+        n_chunks, converged = scan_fastq_sampled(
+            args.fastq[0], [bias], args.tolerance, args.confidence, args.stride)
+        print('Sampled %s reads, %s' % (
+            bias.sample_counts()[0].sum(),
+            'converged' if converged else 'reached end of file'), file=stderr)
+        output_sampled_end_bias(bias, args.confidence)
+    elif args.sample:
+        exit('Error: --sample works on a single .fastq file.')
+    elif len(samples) == 1 and not args.sample_sheet:
+        scan_fastq(args.fastq[0], [bias], threads=args.threads)
+        bias.write()
+    else:
+        output_end_bias_matrix(
+            profile_samples(samples, bias, args.jobs, args.threads))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Shared .fastq reading functions for the fastq_* scripts
+# Created: 2026-10-17
+# Depends: numpy
+
+import gzip
+import zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from copy import deepcopy
+from os.path import basename
+from queue import Queue
+from struct import unpack
+from threading import Thread
+from profile_sampling import has_converged
+
+CHUNK_SIZE = 16 * 1024 * 1024  # Bytes of decompressed .fastq per chunk
+BGZF_BATCH_SIZE = 4 * 1024 * 1024  # Bytes of compressed BGZF per worker task
+WRITE_BLOCK_SIZE = 4 * 1024 * 1024  # Bytes buffered per output write
+SAMPLE_CHUNK_SIZE = 1024 * 1024  # Smaller chunks spread a sample more evenly
+
+
+def magic_open(input_file, mode='rt'):
+    if input_file.endswith('gz'):
+        return gzip.open(input_file, mode)
+    else:
+        return open(input_file, mode)
+
+
+def fastq_yield_seqs(input_fastq):
+    with magic_open(input_fastq) as input_handle:
+        i = 0
+        for line in input_handle:
+            i += 1
+            if i == 2:
+                yield line.strip()
+            elif i == 4:
+                i = 0
+
+
+# Gather the bytes data[start:start + length] for every start/length pair into
+# one contiguous array without a Python loop
+
+def gather_slices(data, starts, lengths):
+    offsets = np.cumsum(lengths) - lengths
+    index = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return data[index], offsets
+
+
+# A block of complete .fastq records held as a uint8 array. Sequence lines are
+# described by their start position and length in that array so no Python
+# string is created per read.
+
+class FastqChunk:
+    def __init__(self, buffer):
+        self.data = np.frombuffer(buffer, dtype=np.uint8)
+        newlines = np.flatnonzero(self.data == 10)
+        line_starts = np.empty_like(newlines)
+        line_starts[0] = 0
+        line_starts[1:] = newlines[:-1] + 1
+        self.record_starts = line_starts[0::4]
+        self.record_ends = newlines[3::4] + 1
+        self.seq_starts = line_starts[1::4]
+        seq_ends = newlines[1::4]
+        seq_ends -= self.data[seq_ends - 1] == 13  # Windows line endings
+        self.lengths = seq_ends - self.seq_starts
+        self._sequences = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    # Concatenated sequence bytes and the offset of each read within them
+
+    def sequences(self):
+        if self._sequences is None:
+            self._sequences = gather_slices(self.data, self.seq_starts,
+                                            self.lengths)
+        return self._sequences
+
+    def iter_sequences(self):
+        for start, length in zip(self.seq_starts.tolist(), self.lengths.tolist()):
+            yield self.data[start:start + length].tobytes().decode()
+
+    # Raw bytes of the records selected by a boolean mask, ready to write
+
+    def records(self, mask):
+        starts = self.record_starts[mask]
+        return gather_slices(self.data, starts,
+                             self.record_ends[mask] - starts)[0].tobytes()
+
+
+# Split an iterator of byte blocks into buffers of complete 4-line records
+
+def record_buffers(byte_blocks):
+    leftover = b''
+    for block in byte_blocks:
+        buffer = leftover + block
+        newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == 10)
+        n_lines = len(newlines) - len(newlines) % 4
+        if n_lines == 0:
+            leftover = buffer
+            continue
+        cut = int(newlines[n_lines - 1]) + 1
+        leftover = buffer[cut:]
+        yield buffer[:cut]
+    if leftover.strip():
+        if not leftover.endswith(b'\n'):
+            leftover += b'\n'
+        if leftover.count(b'\n') % 4:
+            raise ValueError('Truncated .fastq record at end of file')
+        yield leftover
+
+
+def read_blocks(input_handle, chunk_size):
+    while True:
+        block = input_handle.read(chunk_size)
+        if not block:
+            break
+        yield block
+
+
+def fastq_chunks(input_fastq, chunk_size=CHUNK_SIZE):
+    with magic_open(input_fastq, 'rb') as input_handle:
+        for buffer in record_buffers(read_blocks(input_handle, chunk_size)):
+            yield FastqChunk(buffer)
+
+
+# Buffered output. Gzip output is compressed in blocks, each written as its own
+# gzip member (concatenated members are a valid gzip file). With a thread pool
+# the blocks are compressed concurrently, as zlib releases the GIL, and written
+# out in order.
+
+def compress_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class BlockWriter:
+    def __init__(self, output_file, compress=False, pool=None, level=6,
+                 block_size=WRITE_BLOCK_SIZE):
+        self.handle = open(output_file, 'wb')
+        self.compress = compress
+        self.pool = pool
+        self.level = level
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.block_size:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if not self.buffer:
+            return
+        block = bytes(self.buffer)
+        self.buffer = bytearray()
+        if not self.compress:
+            self.handle.write(block)
+        elif self.pool is None:
+            self.handle.write(compress_block(block, self.level))
+        else:
+            self.pending.append(
+                self.pool.submit(compress_block, block, self.level))
+            while self.pending and (self.pending[0].done() or
+                                    len(self.pending) > 4):
+                self.handle.write(self.pending.popleft().result())
+
+    def close(self):
+        self.flush_buffer()
+        while self.pending:
+            self.handle.write(self.pending.popleft().result())
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Parallel ingest. Workers get their own empty copies of the accumulators,
+# fill them from a block of records and send them back to be merged, so every
+# accumulator used with threads > 1 also needs a merge(other) method.
+
+def scan_buffer(buffer, accumulators):
+    if buffer:
+        chunk = FastqChunk(buffer)
+        for accumulator in accumulators:
+            accumulator.add_chunk(chunk)
+    return accumulators
+
+
+def merge_accumulators(accumulators, partials):
+    for accumulator, partial in zip(accumulators, partials):
+        accumulator.merge(partial)
+
+
+def is_bgzf(input_file):
+    with open(input_file, 'rb') as input_handle:
+        header = input_handle.read(16)
+    return (len(header) == 16 and header[:4] == b'\x1f\x8b\x08\x04' and
+            header[12:14] == b'BC')
+
+
+# Offsets and sizes of batches of whole BGZF blocks, read from block headers
+
+def bgzf_batches(input_file, batch_size=BGZF_BATCH_SIZE):
+    with open(input_file, 'rb') as input_handle:
+        batch_start = 0
+        offset = 0
+        while True:
+            header = input_handle.read(18)
+            if len(header) < 18:
+                break
+            block_size = unpack('<H', header[16:18])[0] + 1
+            offset += block_size
+            input_handle.seek(offset)
+            if offset - batch_start >= batch_size:
+                yield batch_start, offset - batch_start
+                batch_start = offset
+        if offset > batch_start:
+            yield batch_start, offset - batch_start
+
+
+# A BGZF batch starts and ends at arbitrary points in the .fastq. The first
+# record start is the first line beginning with '@' whose line two below
+# begins with '+'; a quality line beginning with '@' is always followed two
+# lines later by a sequence line, so this cannot misfire. Returns the bytes
+# before the first record, the filled accumulators and the bytes after the
+# last complete record, or (data, None, b'') if no record starts here.
+
+def scan_bgzf_batch(input_file, offset, size, accumulators):
+    with open(input_file, 'rb') as input_handle:
+        input_handle.seek(offset)
+        data = gzip.decompress(input_handle.read(size))
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+    line_starts = newlines + 1
+    first = None
+    for i in range(min(4, len(line_starts) - 2)):
+        if (data[line_starts[i]:line_starts[i] + 1] == b'@' and
+                data[line_starts[i + 2]:line_starts[i + 2] + 1] == b'+'):
+            first = i
+            break
+    if first is None:
+        return data, None, b''
+    n_lines = len(newlines) - first - 1
+    n_lines -= n_lines % 4
+    start = int(line_starts[first])
+    end = int(newlines[first + n_lines]) + 1 if n_lines else start
+    return (data[:start], scan_buffer(data[start:end], accumulators),
+            data[end:])
+
+
+def merge_bgzf_batch(accumulators, carry, result):
+    head, partials, tail = result
+    carry += head
+    if partials is None:
+        return carry
+    for buffer in record_buffers([carry]):
+        scan_buffer(buffer, accumulators)
+    merge_accumulators(accumulators, partials)
+    return tail
+
+
+def scan_bgzf(input_fastq, accumulators, threads):
+    templates = deepcopy(accumulators)
+    carry = b''
+    pending = []
+    with ProcessPoolExecutor(threads) as pool:
+        for offset, size in bgzf_batches(input_fastq):
+            pending.append(pool.submit(scan_bgzf_batch, input_fastq, offset,
+                                       size, templates))
+            if len(pending) >= threads * 2:
+                carry = merge_bgzf_batch(accumulators, carry,
+                                         pending.pop(0).result())
+        for future in pending:
+            carry = merge_bgzf_batch(accumulators, carry, future.result())
+    for buffer in record_buffers([carry]):
+        scan_buffer(buffer, accumulators)
+    return accumulators
+
+
+# Plain gzip cannot be decompressed in parallel, so a reader thread inflates
+# the file and cuts it into record blocks while worker processes parse them.
+# The reader always ends the queue with None, or with the exception that
+# stopped it, so the scan never waits on a dead thread.
+
+def reader_thread(input_fastq, chunk_size, buffer_queue):
+    end = None
+    try:
+        with magic_open(input_fastq, 'rb') as input_handle:
+            for buffer in record_buffers(read_blocks(input_handle,
+                                                     chunk_size)):
+                buffer_queue.put(buffer)
+    except Exception as error:
+        end = error
+    finally:
+        buffer_queue.put(end)
+
+
+def scan_parallel(input_fastq, accumulators, chunk_size, threads):
+    templates = deepcopy(accumulators)
+    buffer_queue = Queue(maxsize=threads * 2)
+    reader = Thread(target=reader_thread,
+                    args=(input_fastq, chunk_size, buffer_queue), daemon=True)
+    reader.start()
+    pending = []
+    with ProcessPoolExecutor(threads) as pool:
+        while True:
+            buffer = buffer_queue.get()
+            if buffer is None:
+                break
+            if isinstance(buffer, Exception):
+                reader.join()
+                raise buffer
+            pending.append(pool.submit(scan_buffer, buffer, templates))
+            if len(pending) >= threads * 2:
+                merge_accumulators(accumulators, pending.pop(0).result())
+        for future in pending:
+            merge_accumulators(accumulators, future.result())
+    reader.join()
+    return accumulators
+
+
+# Read the file once and hand every chunk to each accumulator. Accumulators
+# are objects with an add_chunk(chunk) method and a write(output_handle)
+# method, and must be empty when the scan starts.
+
+def scan_fastq(input_fastq, accumulators, chunk_size=CHUNK_SIZE, threads=1):
+    if threads > 1 and input_fastq.endswith('gz') and is_bgzf(input_fastq):
+        return scan_bgzf(input_fastq, accumulators, threads)
+    elif threads > 1:
+        return scan_parallel(input_fastq, accumulators, chunk_size, threads)
+    for chunk in fastq_chunks(input_fastq, chunk_size):
+        for accumulator in accumulators:
+            accumulator.add_chunk(chunk)
+    return accumulators
+
+
+# Sampled scan for quick estimates. Every stride-th chunk is profiled and the
+# scan stops as soon as every bin of every accumulator's sample_counts() has a
+# confidence interval within the tolerance. With the default stride of 1 the
+# sample is the head of the file; a larger stride spreads it further. Skipped
+# chunks are only cut at record boundaries, never parsed. Returns the number
+# of chunks used and whether the estimates converged before the end of the
+# file.
+
+def scan_fastq_sampled(input_fastq, accumulators, tolerance, confidence=0.95,
+                       stride=1, chunk_size=SAMPLE_CHUNK_SIZE):
+    n_chunks = 0
+    with magic_open(input_fastq, 'rb') as input_handle:
+        for i, buffer in enumerate(record_buffers(read_blocks(input_handle,
+                                                              chunk_size))):
+            if i % stride:
+                continue
+            n_chunks += 1
+            chunk = FastqChunk(buffer)
+            for accumulator in accumulators:
+                accumulator.add_chunk(chunk)
+            if all(has_converged(accumulator.sample_counts(), tolerance,
+                                 confidence) for accumulator in accumulators):
+                return n_chunks, True
+    return n_chunks, False
+
+
+# Batch mode. Samples come from a list of paths (named by file name) or a
+# tab-separated sample sheet of sample name and path, and are profiled in
+# parallel with one worker process per sample.
+
+def sample_name(input_fastq, suffixes=('.gz', '.fastq', '.fq')):
+    name = basename(input_fastq)
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def read_sample_sheet(sample_sheet):
+    samples = []
+    with magic_open(sample_sheet) as input_handle:
+        for line in input_handle:
+            if not line.strip() or line.startswith('#'):
+                continue
+            entry = line.strip().split('\t')
+            samples.append((entry[0], entry[1]))
+    return samples
+
+
+def get_samples(fastq_files, sample_sheet=None):
+    samples = [(sample_name(fastq), fastq) for fastq in fastq_files]
+    if sample_sheet:
+        samples += read_sample_sheet(sample_sheet)
+    names = [name for name, path in samples]
+    if len(set(names)) != len(names):
+        raise ValueError('Sample names must be unique')
+    return samples
+
+
+def profile_sample(input_fastq, accumulator, threads):
+    return scan_fastq(input_fastq, [accumulator], threads=threads)[0]
+
+
+def profile_samples(samples, accumulator, jobs, threads=1):
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(profile_sample, path, accumulator, threads)
+                   for name, path in samples]
+        return [(name, future.result())
+                for (name, path), future in zip(samples, futures)]
@@ -3,30 +3,53 @@
 # Author: Jeffrey Grover
 # Purpose: Filter .fastq reads between sizes defined by user input.
 # Created: 12/2016
+# Depends: numpy
 
 from argparse import ArgumentParser
-import gzip
+from concurrent.futures import ThreadPoolExecutor
+from sys import exit, stdout
+from fastq_io import BlockWriter, fastq_chunks
 
 
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
+def filter_by_length(input_path, min_length, max_length, output_handle=None):
+    if output_handle is None:
+        output_handle = stdout.buffer
+    for chunk in fastq_chunks(input_path):
+        keep = (min_length <= chunk.lengths) & (chunk.lengths <= max_length)
+        output_handle.write(chunk.records(keep))
+
+
+# Length bins are given as NAME:MIN-MAX or NAME:LENGTH, e.g. 21nt:21
+
+def parse_length_bin(bin_string):
+    name, lengths = bin_string.split(':')
+    if '-' in lengths:
+        min_length, max_length = lengths.split('-')
     else:
-        return open(input_file, 'r')
+        min_length = max_length = lengths
+    return name, int(min_length), int(max_length)
 
 
-def filter_by_length(input_path, output_path, min_length, max_length):
-    n = 0
-    fastq_record = []
-    with magic_open(input_path, 'r') as input_file:
-        for line in input_file:
-            n += 1
-            fastq_record.append(line.strip())
-            if n == 4:
-                if min_length <= len(fastq_record[1]) <= max_length:
-                    print('\n'.join(fastq_record))
-                n = 0
-                fastq_record = []
+# Write the reads in each length bin to its own file in one pass over the input
+
+def demultiplex_by_length(input_path, length_bins, output_prefix,
+                          compress=False, threads=1):
+    suffix = '.fastq.gz' if compress else '.fastq'
+    pool = ThreadPoolExecutor(threads) if compress and threads > 1 else None
+    writers = [BlockWriter(output_prefix + '.' + name + suffix, compress, pool)
+               for name, min_length, max_length in length_bins]
+    try:
+        for chunk in fastq_chunks(input_path):
+            for writer, (name, min_length, max_length) in zip(writers,
+                                                              length_bins):
+                keep = ((min_length <= chunk.lengths) &
+                        (chunk.lengths <= max_length))
+                writer.write(chunk.records(keep))
+    finally:
+        for writer in writers:
+            writer.close()
+        if pool is not None:
+            pool.shutdown()
 
 
 # Parse command line options
@@ -40,13 +63,40 @@ def get_args():
                         metavar='FILE.fastq(.gz)')
     parser.add_argument('-n', '--min', help='Minimum length for filtering', type=int)
     parser.add_argument('-m', '--max', help='Maximum length for filtering', type=int)
+    parser.add_argument('-b', '--bin',
+                        help='Named length bin written to PREFIX.NAME.fastq, '
+                        'may be given several times (ex. -b 21nt:21 -b 24nt:24 '
+                        '-b long:25-30)',
+                        action='append',
+                        metavar='NAME:MIN-MAX')
+    parser.add_argument('-o', '--output_prefix',
+                        help='Prefix for the length bin output files',
+                        metavar='PREFIX')
+    parser.add_argument('-z', '--gzip',
+                        help='gzip compress the length bin output files',
+                        action='store_true')
+    parser.add_argument('-t', '--threads',
+                        help='Threads for gzip compression (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
 # Filter the .fastq
 
 def main(args):
-    filter_by_length(args.fastq, args.min, args.max)
+    if args.bin:
+        if not args.output_prefix:
+            exit('Error: Length bins need an output prefix (-o).')
+        try:
+            length_bins = [parse_length_bin(bin_string) for bin_string in args.bin]
+        except ValueError:
+            exit('Error: Length bins must be given as NAME:MIN-MAX or NAME:LENGTH')
+        demultiplex_by_length(args.fastq, length_bins, args.output_prefix,
+                              args.gzip, args.threads)
+    else:
+        filter_by_length(args.fastq, args.min, args.max)
 
 
 if __name__ == '__main__':
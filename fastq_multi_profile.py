@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Run several .fastq profiles (lengths, end bias, nucleotide frequency
+# by position, unique sequences) from a single read of the input file
+# Created: 2026-10-17
+
+from argparse import ArgumentParser
+from sys import exit
+from fastq_io import scan_fastq
+from fastq_readlength_profile import LengthProfile
+from fastq_end_bias import EndBias
+from fastq_nucleotide_freq_by_position import PositionFrequency
+from fastq_unique_seqs import SequenceCounter
+
+
+def build_accumulators(args):
+    accumulators = []
+    if args.lengths:
+        accumulators.append(('lengths.tsv', LengthProfile()))
+    if args.end_bias:
+        accumulators.append(
+            ('end_bias.csv', EndBias(args.min_length, args.max_length)))
+    if args.position_length:
+        accumulators.append(
+            ('position_freq.csv', PositionFrequency(args.position_length)))
+    if args.unique:
+        accumulators.append(
+            ('unique_seqs.tsv', SequenceCounter(args.min_length, args.max_length)))
+    return accumulators
+
+
+def write_outputs(accumulators, prefix):
+    for suffix, accumulator in accumulators:
+        with open('%s.%s' % (prefix, suffix), 'w') as output_handle:
+            accumulator.write(output_handle)
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Profile a .fastq file with several profilers while '
+        'reading it only once. Each profile is written to PREFIX.<profile> in '
+        'the same format as the matching single-purpose script.')
+    parser.add_argument('fastq',
+                        help='Input .fastq, may be gzipped',
+                        metavar='FILE.fastq(.gz)')
+    parser.add_argument('-o', '--output_prefix',
+                        help='Prefix for the output files',
+                        required=True,
+                        metavar='PREFIX')
+    parser.add_argument('--lengths',
+                        help='Count reads of each length (fastq_readlength_profile)',
+                        action='store_true')
+    parser.add_argument('--end_bias',
+                        help='Profile 5\' and 3\' nucleotide bias (fastq_end_bias)',
+                        action='store_true')
+    parser.add_argument('--position_length',
+                        help='Profile nucleotide content by position for reads '
+                        'of this length (fastq_nucleotide_freq_by_position)',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--unique',
+                        help='Count unique sequences (fastq_unique_seqs)',
+                        action='store_true')
+    parser.add_argument('-n', '--min_length',
+                        help='Minimum length of reads for end bias and unique '
+                        'sequences (default=0)',
+                        default=0,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-m', '--max_length',
+                        help='Maximum length of reads for end bias and unique '
+                        'sequences (default=150)',
+                        default=150,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-t', '--threads',
+                        help='Worker processes for parsing; BGZF input is '
+                        'also decompressed in parallel (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    accumulators = build_accumulators(args)
+    if not accumulators:
+        exit('Error: Select at least one profile to run.')
+    scan_fastq(args.fastq, [accumulator for suffix, accumulator in accumulators],
+               threads=args.threads)
+    write_outputs(accumulators, args.output_prefix)
+
+
+if __name__ == '__main__':
+    main(get_args())
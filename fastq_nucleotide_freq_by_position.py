@@ -3,51 +3,112 @@
 # Author: Jeffrey Grover
 # Purpose: Profile nucleotide bias by position from reads in a .fastq file
 # Created: 2019-08-09
+# Depends: numpy
 
 # Warning: this script requires sorted dictionary behavior and will likely not
 # work with Python < 3.6
 
-import gzip
 from argparse import ArgumentParser
-
-
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
-
-
-def fastq_yield_seqs(input_fastq):
-    with magic_open(input_fastq) as input_handle:
-        i = 0
-        for line in input_handle:
-            i += 1
-            if i == 2:
-                yield line.strip()
-            elif i == 4:
-                i = 0
+from sys import exit, stdout
+import numpy as np
+from fastq_io import gather_slices, scan_fastq
+
+BASES = 'ATCG'
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for code, base in enumerate(BASES.encode()):
+    BASE_CODES[base] = code
+
+
+# Counts held as a length x position x base array, filled by a bincount over
+# packed (length, position, base) indices for every base in a chunk. Bases
+# other than A, T, C or G are not counted.
+
+class LengthPositionFrequency:
+    def __init__(self, min_length, max_length):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.counts = np.zeros(
+            (max_length - min_length + 1, max_length, len(BASES)),
+            dtype=np.int64)
+
+    def add_sequences(self, data, offsets, lengths):
+        read_index = np.repeat(np.arange(len(lengths)), lengths)
+        position = np.arange(len(data)) - offsets[read_index]
+        codes = BASE_CODES[data]
+        valid = codes != 255
+        index = (((lengths[read_index] - self.min_length) * self.max_length +
+                  position) * len(BASES) + codes)[valid]
+        self.counts += np.bincount(
+            index, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def add(self, sequence):
+        if self.min_length <= len(sequence) <= self.max_length:
+            self.add_sequences(np.frombuffer(sequence.encode(), dtype=np.uint8),
+                               np.zeros(1, dtype=np.int64),
+                               np.array([len(sequence)]))
+
+    def add_chunk(self, chunk):
+        keep = ((self.min_length <= chunk.lengths) &
+                (chunk.lengths <= self.max_length))
+        lengths = chunk.lengths[keep]
+        data, offsets = gather_slices(chunk.data, chunk.seq_starts[keep],
+                                      lengths)
+        self.add_sequences(data, offsets, lengths)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def position_freq_dict(self, length):
+        length_counts = self.counts[length - self.min_length]
+        return {position + 1: dict(zip(BASES, length_counts[position].tolist()))
+                for position in range(length)}
+
+    def write(self, output_handle=stdout):
+        print('length', 'position', *BASES, sep=',', file=output_handle)
+        for length in range(self.min_length, self.max_length + 1):
+            for position, freq_dict in self.position_freq_dict(length).items():
+                print(length, position, *freq_dict.values(), sep=',',
+                      file=output_handle)
+
+    def write_per_length(self, output_prefix):
+        for length in range(self.min_length, self.max_length + 1):
+            with open('%s.%s.csv' % (output_prefix, length), 'w') as output_handle:
+                output_position_freq(self.position_freq_dict(length),
+                                     output_handle)
+
+
+class PositionFrequency(LengthPositionFrequency):
+    def __init__(self, length):
+        LengthPositionFrequency.__init__(self, length, length)
+        self.length = length
+
+    def write(self, output_handle=stdout):
+        output_position_freq(self.position_freq_dict(self.length),
+                             output_handle)
 
 
 def profile_reads(fastq_seqs, length):
-    position_freq_dict = {}
-    for i in range(length):
-        position = i + 1
-        position_freq_dict.update({position: {'A': 0, 'T': 0, 'C': 0, 'G': 0}})
+    position_freq = PositionFrequency(length)
     for sequence in fastq_seqs:
-        position = 0
-        if len(sequence) == length:
-            for base in sequence:
-                position += 1
-                position_freq_dict[position][base] += 1
-    return position_freq_dict
+        position_freq.add(sequence)
+    return position_freq.position_freq_dict(length)
+
+
+def output_position_freq(position_freq_dict, output_handle=stdout):
+    print('position', 'A', 'T', 'C', 'G', sep=',', file=output_handle)
+    for position, freq_dict in position_freq_dict.items():
+        line = [str(position)]
+        for base, count in freq_dict.items():
+            line.append(str(count))
+        print(','.join(line), file=output_handle)
 
 
 # Command line parser
 
 def get_args():
     parser = ArgumentParser(
-        description='Profile nucleotide content by position from a .fastq file')
+        description='Profile nucleotide content by position from a .fastq '
+        'file, for one read length or for every length in a range at once')
     parser.add_argument('fastq',
                         help='Input .fastq, may be gzipped',
                         metavar='FILE.fastq(.gz)')
@@ -55,19 +116,47 @@ def get_args():
                         help='Length of reads to profile',
                         type=int,
                         metavar='INT')
+    parser.add_argument('-n', '--min_length',
+                        help='Minimum length of reads to profile, instead of '
+                        '--length',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-m', '--max_length',
+                        help='Maximum length of reads to profile, instead of '
+                        '--length',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-o', '--output_prefix',
+                        help='With a length range, write one PREFIX.LENGTH.csv '
+                        'per length instead of a long table to stdout',
+                        metavar='PREFIX')
+    parser.add_argument('-t', '--threads',
+                        help='Worker processes for parsing; BGZF input is '
+                        'also decompressed in parallel (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
 # Main function entry point
 
 def main(args):
-    read_profile = profile_reads(fastq_yield_seqs(args.fastq), args.length)
-    print('position', 'A', 'T', 'C', 'G', sep=',')
-    for position, freq_dict in read_profile.items():
-        line = [str(position)]
-        for base, count in freq_dict.items():
-            line.append(str(count))
-        print(','.join(line))
+    if args.length:
+        position_freq = PositionFrequency(args.length)
+        scan_fastq(args.fastq, [position_freq], threads=args.threads)
+        position_freq.write()
+    elif args.min_length is not None and args.max_length is not None:
+        if not 0 <= args.min_length <= args.max_length:
+            exit('Error: Give 0 <= --min_length <= --max_length.')
+        position_freq = LengthPositionFrequency(args.min_length, args.max_length)
+        scan_fastq(args.fastq, [position_freq], threads=args.threads)
+        if args.output_prefix:
+            position_freq.write_per_length(args.output_prefix)
+        else:
+            position_freq.write()
+    else:
+        exit('Error: Give either --length or --min_length and --max_length.')
 
 
 if __name__ == '__main__':
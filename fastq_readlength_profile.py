@@ -3,55 +3,241 @@
 # Author: Jeffrey Grover
 # Purpose: Count the number of reads of each size in a .fastq
 # Created: 02/2019
+# Depends: numpy
 
 from argparse import ArgumentParser
-import gzip
+from sys import exit, stderr, stdout
+import numpy as np
+from fastq_io import (get_samples, profile_samples, scan_fastq,
+                      scan_fastq_sampled)
+from profile_sampling import interval_rows
+from result_cache import (DEFAULT_CACHE_DIR, ResultCache, cache_key,
+                          input_fingerprint)
+
+# Bump when the counting changes so stale cached histograms are not reused
+CACHE_VERSION = 1
+
+
+class LengthProfile:
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add_counts(self, counts):
+        if len(counts) > len(self.counts):
+            counts = counts.copy()
+            counts[:len(self.counts)] += self.counts
+            self.counts = counts
+        else:
+            self.counts[:len(counts)] += counts
+
+    def add_chunk(self, chunk):
+        self.add_counts(np.bincount(chunk.lengths))
+
+    def merge(self, other):
+        self.add_counts(other.counts)
+
+    def sample_counts(self):
+        return self.counts
+
+    def fastq_lengths_dict(self):
+        return {int(length): int(self.counts[length])
+                for length in np.flatnonzero(self.counts)}
+
+    def window(self, min_len=None, max_len=None):
+        if min_len is not None:
+            self.counts[:min_len] = 0
+        if max_len is not None:
+            self.counts[max_len + 1:] = 0
+        return self
+
+    def write(self, output_handle=stdout):
+        output_fastq_lengths(self.fastq_lengths_dict(), output_handle)
+
+
+def fastq_length_profile(input_fastq, threads=1):
+    length_profile = LengthProfile()
+    scan_fastq(input_fastq, [length_profile], threads=threads)
+    return length_profile.fastq_lengths_dict()
+
+
+# Cached mode. The full histogram of each file is stored on disk so reruns,
+# with any length window, skip the scan. Only files missing from the cache are
+# profiled.
+
+def length_cache_key(input_fastq, content_hash=False):
+    return cache_key('fastq_readlength_profile', CACHE_VERSION,
+                     [input_fingerprint(input_fastq, content_hash)])
+
+
+def cached_length_profiles(samples, cache, content_hash=False, jobs=1,
+                           threads=1):
+    keys = [length_cache_key(fastq, content_hash) for name, fastq in samples]
+    profiles = {}
+    missing = []
+    for (name, fastq), key in zip(samples, keys):
+        entry = cache.load(key)
+        if entry is None:
+            missing.append((name, fastq))
+        else:
+            profiles[name] = LengthProfile()
+            profiles[name].add_counts(entry['counts'])
+    if len(missing) == 1:
+        profiles[missing[0][0]] = LengthProfile()
+        scan_fastq(missing[0][1], [profiles[missing[0][0]]], threads=threads)
+    elif missing:
+        profiles.update(profile_samples(missing, LengthProfile(), jobs,
+                                        threads))
+    for (name, fastq), key in zip(samples, keys):
+        if (name, fastq) in missing:
+            cache.store(key, counts=profiles[name].counts)
+    return [(name, profiles[name]) for name, fastq in samples]
+
+
+def output_fastq_lengths(input_fastq_lengths_dict, output_handle=stdout):
+    print('length', 'count', sep='\t', file=output_handle)
+    for seq_length, count in sorted(input_fastq_lengths_dict.items()):
+        print(seq_length, count, sep='\t', file=output_handle)
 
 
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
-
-
-def fastq_length_profile(input_fastq):
-    fastq_lengths_dict = {}
-    with magic_open(input_fastq) as input_handle:
-        n = 0
-        for line in input_handle:
-            n += 1
-            seq_length = len(line.strip())
-            if n == 2 and seq_length not in fastq_lengths_dict:
-                fastq_lengths_dict[seq_length] = 1
-            elif n == 2 and seq_length in fastq_lengths_dict:
-                fastq_lengths_dict[seq_length] += 1
-            elif n == 4:
-                n = 0
-    return fastq_lengths_dict
-
-
-def output_fastq_lengths(input_fastq_lengths_dict):
-    print('length', 'count', sep='\t')
-    for seq_length, count in sorted(input_fastq_lengths_dict.items()):
-        print(seq_length, count, sep='\t')
+def output_sampled_lengths(length_profile, confidence, output_handle=stdout):
+    lengths = np.flatnonzero(length_profile.counts)
+    print('length', 'count', 'proportion', 'ci_low', 'ci_high', sep='\t',
+          file=output_handle)
+    for row in interval_rows(lengths.tolist(),
+                             length_profile.counts[lengths], confidence):
+        print(*row, sep='\t', file=output_handle)
+
+
+def output_length_matrix(sample_profiles, output_handle=stdout):
+    width = max(len(profile.counts) for name, profile in sample_profiles)
+    matrix = np.zeros((len(sample_profiles), width), dtype=np.int64)
+    for i, (name, profile) in enumerate(sample_profiles):
+        matrix[i, :len(profile.counts)] = profile.counts
+    lengths = np.flatnonzero(matrix.sum(axis=0))
+    print('sample', *lengths, sep='\t', file=output_handle)
+    for (name, profile), row in zip(sample_profiles, matrix[:, lengths]):
+        print(name, *row, sep='\t', file=output_handle)
 
 
 # Parse command line options
 
 def get_args():
     parser = ArgumentParser(
-        description='Counts the different lengths of reads in a .fastq file.')
+        description='Counts the different lengths of reads in a .fastq file. '
+        'Several files are profiled in parallel into one sample by length '
+        'matrix.')
     parser.add_argument('fastq',
                         help='Input .fastq(.gz)',
+                        nargs='*',
                         metavar='FILE')
+    parser.add_argument('-s', '--sample_sheet',
+                        help='Tab-separated file of sample name and .fastq(.gz) '
+                        'path, one sample per line',
+                        metavar='FILE.tsv')
+    parser.add_argument('-j', '--jobs',
+                        help='Number of samples to profile at once (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--sample',
+                        help='Estimate the profile from a sample of reads, '
+                        'stopping once every proportion is within '
+                        '--tolerance, and report confidence intervals',
+                        action='store_true')
+    parser.add_argument('--tolerance',
+                        help='Largest confidence interval half-width accepted '
+                        'for each proportion when sampling (default=0.005)',
+                        default=0.005,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--confidence',
+                        help='Confidence level of the intervals (default=0.95)',
+                        default=0.95,
+                        type=float,
+                        metavar='FLOAT')
+    parser.add_argument('--stride',
+                        help='When sampling, profile every INT-th block of '
+                        'about 1 MB of reads; the default of 1 samples the '
+                        'start of the file, larger values spread the sample '
+                        'through it (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-t', '--threads',
+                        help='Worker processes for parsing; BGZF input is '
+                        'also decompressed in parallel (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-n', '--min_length',
+                        help='Only report reads of at least this length',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-m', '--max_length',
+                        help='Only report reads of at most this length',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--cache',
+                        help='Store the histogram of all read lengths of each '
+                        'file on disk and answer later runs on unchanged files, '
+                        'with any length window, from it',
+                        action='store_true')
+    parser.add_argument('--cache_dir',
+                        help='Cache directory (default=%s)' % DEFAULT_CACHE_DIR,
+                        default=DEFAULT_CACHE_DIR,
+                        metavar='DIR')
+    parser.add_argument('--cache_size',
+                        help='Size in MB the cache is trimmed to, least '
+                        'recently used first (default=2048)',
+                        default=2048,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--cache_hash',
+                        help='Identify files by a hash of their contents '
+                        'rather than their path, size and modification time',
+                        action='store_true')
     return parser.parse_args()
 
 
 # Parse and count
 
 def main(args):
-    output_fastq_lengths(fastq_length_profile(args.fastq))
+    try:
+        samples = get_samples(args.fastq, args.sample_sheet)
+    except ValueError as error:
+        exit('Error: %s' % error)
+    if not samples:
+        exit('Error: No input .fastq files given.')
+    if args.sample and len(samples) == 1 and not args.sample_sheet:
+        length_profile = LengthProfile()
+        n_chunks, converged = scan_fastq_sampled(
+            args.fastq[0], [length_profile], args.tolerance, args.confidence,
+            args.stride)
+        print('Sampled %s reads, %s' % (
+            length_profile.counts.sum(),
+            'converged' if converged else 'reached end of file'), file=stderr)
+        length_profile.window(args.min_length, args.max_length)
+        output_sampled_lengths(length_profile, args.confidence)
+    elif args.sample:
+        exit('Error: --sample works on a single .fastq file.')
+    else:
+        if args.cache:
+            cache = ResultCache(args.cache_dir, args.cache_size * 1024 ** 2)
+            sample_profiles = cached_length_profiles(
+                samples, cache, args.cache_hash, args.jobs, args.threads)
+        elif len(samples) == 1 and not args.sample_sheet:
+            length_profile = LengthProfile()
+            scan_fastq(args.fastq[0], [length_profile], threads=args.threads)
+            sample_profiles = [(samples[0][0], length_profile)]
+        else:
+            sample_profiles = profile_samples(samples, LengthProfile(),
+                                              args.jobs, args.threads)
+        for name, length_profile in sample_profiles:
+            length_profile.window(args.min_length, args.max_length)
+        if len(samples) == 1 and not args.sample_sheet:
+            sample_profiles[0][1].write()
+        else:
+            output_length_matrix(sample_profiles)
 
 
 if __name__ == '__main__':
@@ -3,39 +3,69 @@
 # Author: Jeffrey Grover
 # Purpose: Output the unique sequences found in a .fastq file
 # Created: 2020-03-04
+# Depends: numpy
 
 from argparse import ArgumentParser
-import gzip
-
-
-def magic_open(input_file):
-    if input_file.endswith('gz'):
-        return gzip.open(input_file, 'rt')
-    else:
-        return open(input_file, 'r')
-
-
-def fastq_count_seqs(input_fastq, min_len, max_len):
-    profile_dict = {}
-    with magic_open(input_fastq) as input_handle:
-        n = 0
-        for line in input_handle:
-            n += 1
-            if n == 2:
-                seq = line.strip()
-                if min_len <= len(seq) <= max_len:
-                    if seq not in profile_dict:
-                        profile_dict.update({seq: 0})
-                    profile_dict[seq] += 1
-            elif n == 4:
-                n = 0
-    return profile_dict
-
-
-def output_profile(profile_dict):
-    print('sequence', 'count', sep='\t')
+from sys import stdout
+from fastq_io import gather_slices, scan_fastq
+from seq_counting import (PackedSequenceCounter, TopSequenceCounter,
+                          report_top_counter)
+
+
+class SequenceCounter:
+    def __init__(self, min_len, max_len, packed=False, counter=None):
+        self.min_len = min_len
+        self.max_len = max_len
+        if counter is None:
+            counter = PackedSequenceCounter() if packed else {}
+        self.packed = not isinstance(counter, dict)
+        self.profile_dict = counter
+
+    def add(self, sequence):
+        if self.min_len <= len(sequence) <= self.max_len:
+            if self.packed:
+                self.profile_dict.add(sequence)
+                return
+            if sequence not in self.profile_dict:
+                self.profile_dict.update({sequence: 0})
+            self.profile_dict[sequence] += 1
+
+    def add_chunk(self, chunk):
+        if self.packed:
+            keep = ((self.min_len <= chunk.lengths) &
+                    (chunk.lengths <= self.max_len))
+            lengths = chunk.lengths[keep]
+            data, offsets = gather_slices(chunk.data, chunk.seq_starts[keep],
+                                          lengths)
+            self.profile_dict.add_sequences(data, offsets, lengths)
+            return
+        for sequence in chunk.iter_sequences():
+            self.add(sequence)
+
+    def merge(self, other):
+        if self.packed:
+            self.profile_dict.merge(other.profile_dict)
+            return
+        for sequence, count in other.profile_dict.items():
+            if sequence not in self.profile_dict:
+                self.profile_dict.update({sequence: 0})
+            self.profile_dict[sequence] += count
+
+    def write(self, output_handle=stdout):
+        output_profile(self.profile_dict, output_handle)
+
+
+def fastq_count_seqs(input_fastq, min_len, max_len, threads=1, packed=False,
+                     counter=None):
+    counter = SequenceCounter(min_len, max_len, packed, counter)
+    scan_fastq(input_fastq, [counter], threads=threads)
+    return counter.profile_dict
+
+
+def output_profile(profile_dict, output_handle=stdout):
+    print('sequence', 'count', sep='\t', file=output_handle)
     for sequence, count in profile_dict.items():
-        print(sequence, count, sep='\t')
+        print(sequence, count, sep='\t', file=output_handle)
 
 
 # Command line parser
@@ -54,14 +84,44 @@ def get_args():
                         help='Maximum length of reads to profile',
                         type=int,
                         metavar='INT')
+    parser.add_argument('-p', '--packed',
+                        help='Count sequences as 2-bit packed keys to save '
+                        'memory on deep libraries (output is grouped by length '
+                        'instead of in order of appearance)',
+                        action='store_true')
+    parser.add_argument('--top',
+                        help='Only report the INT most abundant sequences, '
+                        'sorted by count, using a fixed-size table instead of '
+                        'counting every sequence; the number of distinct '
+                        'sequences is estimated and reported on stderr',
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('--max_tracked',
+                        help='With --top, the most sequences held in memory; '
+                        'larger is more accurate (default=100000)',
+                        default=100000,
+                        type=int,
+                        metavar='INT')
+    parser.add_argument('-t', '--threads',
+                        help='Worker processes for parsing; BGZF input is '
+                        'also decompressed in parallel (default=1)',
+                        default=1,
+                        type=int,
+                        metavar='INT')
     return parser.parse_args()
 
 
 # Main function entry point
 
 def main(args):
-    profile = fastq_count_seqs(args.fastq, args.min_length, args.max_length)
+    top_counter = None
+    if args.top:
+        top_counter = TopSequenceCounter(args.top, args.max_tracked)
+    profile = fastq_count_seqs(args.fastq, args.min_length, args.max_length,
+                               args.threads, args.packed, top_counter)
     output_profile(profile)
+    if top_counter is not None:
+        report_top_counter(top_counter)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Build a memory-mapped, per-chromosome index of a methylation
+# .bedGraph (sorted positions and cumulative methylated/unmethylated counts)
+# so any feature set is summed with two binary searches per feature
+# Created: 2026-10-17
+# Depends: numpy
+
+import json
+import numpy as np
+from argparse import ArgumentParser
+from os import getpid, makedirs, remove, rename
+from os.path import exists, join
+from shutil import rmtree
+from sys import stderr
+from bedgraph_io import bedgraph_chunks
+from result_cache import input_fingerprint
+
+INDEX_VERSION = 1
+BUFFER_SIZE = 64 * 1024 * 1024  # Bytes of sites buffered before a flush
+
+
+def default_index_dir(input_bedgraph):
+    return input_bedgraph + '.index'
+
+
+# Sites are buffered per chromosome as the .bedGraph streams past and appended
+# to raw per-chromosome files whenever the buffers fill, so no file stays open
+# however many contigs the assembly has. Each chromosome is then sorted by
+# start (only if needed) and saved as .npy: starts, cumulative counts by start,
+# and ends. When sites overlap, the ends are not in start order and get their
+# own sorted copy and cumulative counts.
+
+def finish_chrom(index_dir, i, n_sites):
+    raw = join(index_dir, '%s.%%s.raw' % i)
+    npy = join(index_dir, '%s.%%s.npy' % i)
+    starts = np.memmap(raw % 'starts', dtype=np.int64, mode='r')
+    ends = np.memmap(raw % 'ends', dtype=np.int64, mode='r')
+    counts = np.memmap(raw % 'counts', dtype=np.int64, mode='r',
+                       shape=(n_sites, 2))
+    if (starts[1:] < starts[:-1]).any():
+        order = np.argsort(starts, kind='stable')
+        starts, ends, counts = starts[order], ends[order], counts[order]
+    np.save(npy % 'starts', starts)
+    sums = np.lib.format.open_memmap(npy % 'start_sums', 'w+', np.int64,
+                                     (n_sites + 1, 2))
+    sums[0] = 0
+    np.cumsum(counts, axis=0, out=sums[1:])
+    sums.flush()
+    if (ends[1:] < ends[:-1]).any():
+        order = np.argsort(ends, kind='stable')
+        ends, counts = ends[order], counts[order]
+        sums = np.lib.format.open_memmap(npy % 'end_sums', 'w+', np.int64,
+                                         (n_sites + 1, 2))
+        sums[0] = 0
+        np.cumsum(counts, axis=0, out=sums[1:])
+        sums.flush()
+    np.save(npy % 'ends', ends)
+    del starts, ends, counts, sums
+    for name in ('starts', 'ends', 'counts'):
+        remove(raw % name)
+
+
+def flush_chroms(temp_dir, buffers):
+    for i, columns in buffers.items():
+        for name, blocks in zip(('starts', 'ends', 'counts'), columns):
+            with open(join(temp_dir, '%s.%s.raw' % (i, name)), 'ab') as handle:
+                handle.write(b''.join(blocks))
+    buffers.clear()
+
+
+def build_index(input_bedgraph, index_dir):
+    temp_dir = '%s.tmp%s' % (index_dir, getpid())
+    makedirs(temp_dir)
+    chroms = {}
+    n_sites = []
+    buffers = {}
+    buffered = 0
+    try:
+        for chunk in bedgraph_chunks(input_bedgraph):
+            columns = [chunk.column(1), chunk.column(2),
+                       np.stack((chunk.column(4), chunk.column(5)), axis=1)]
+            for chrom, lines in chunk.chrom_groups():
+                if chrom not in chroms:
+                    chroms[chrom] = len(chroms)
+                    n_sites.append(0)
+                i = chroms[chrom]
+                if i not in buffers:
+                    buffers[i] = ([], [], [])
+                for blocks, column in zip(buffers[i], columns):
+                    blocks.append(np.ascontiguousarray(column[lines]).tobytes())
+                    buffered += len(blocks[-1])
+                n_sites[i] += len(columns[0][lines])
+            if buffered >= BUFFER_SIZE:
+                flush_chroms(temp_dir, buffers)
+                buffered = 0
+        flush_chroms(temp_dir, buffers)
+        for chrom, i in chroms.items():
+            finish_chrom(temp_dir, i, n_sites[i])
+        with open(join(temp_dir, 'index.json'), 'w') as output_handle:
+            json.dump({'version': INDEX_VERSION,
+                       'source': input_fingerprint(input_bedgraph),
+                       'chroms': list(chroms), 'sites': n_sites},
+                      output_handle)
+    except BaseException:
+        rmtree(temp_dir, ignore_errors=True)
+        raise
+    if exists(index_dir):
+        rmtree(index_dir)
+    rename(temp_dir, index_dir)
+
+
+# Reading side. Arrays are opened with np.load(mmap_mode='r'), so a query only
+# touches the pages its binary searches land on.
+
+class MethylationIndex:
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(join(index_dir, 'index.json')) as input_handle:
+            self.info = json.load(input_handle)
+        self.chroms = {chrom: i for i, chrom in enumerate(self.info['chroms'])}
+
+    def is_current(self, input_bedgraph):
+        return (self.info['version'] == INDEX_VERSION and
+                self.info['source'] == input_fingerprint(input_bedgraph))
+
+    def array(self, i, name):
+        return np.load(join(self.index_dir, '%s.%s.npy' % (i, name)),
+                       mmap_mode='r')
+
+    # Methylated and unmethylated counts of the sites overlapping each feature
+
+    def overlap_sums(self, chrom, feature_starts, feature_ends):
+        if chrom not in self.chroms:
+            return np.zeros((len(feature_starts), 2), dtype=np.int64)
+        i = self.chroms[chrom]
+        start_sums = self.array(i, 'start_sums')
+        if exists(join(self.index_dir, '%s.end_sums.npy' % i)):
+            end_sums = self.array(i, 'end_sums')
+        else:
+            end_sums = start_sums
+        return (start_sums[np.searchsorted(self.array(i, 'starts'),
+                                           feature_ends, 'left')] -
+                end_sums[np.searchsorted(self.array(i, 'ends'),
+                                         feature_starts, 'right')])
+
+
+# Open the index of a .bedGraph, building it first if it is missing or the
+# .bedGraph has changed since
+
+def open_index(index_dir, input_bedgraph=None):
+    if input_bedgraph is not None:
+        if (not exists(join(index_dir, 'index.json')) or
+                not MethylationIndex(index_dir).is_current(input_bedgraph)):
+            print('Indexing .bedGraph file: %s' % input_bedgraph, file=stderr)
+            build_index(input_bedgraph, index_dir)
+    return MethylationIndex(index_dir)
+
+
+# Command line parser
+
+def get_args():
+    parser = ArgumentParser(
+        description='Convert a methylation .bedGraph (from MethylDackel for '
+        'example) into a memory-mapped index for bedgraph_methylation_by_bed.py '
+        '--index.')
+    parser.add_argument('bedGraph',
+                        help='bedGraph file of methylation calls, in any order',
+                        metavar='FILE.bedGraph(.gz)')
+    parser.add_argument('-o', '--output',
+                        help='Index directory (default=FILE.bedGraph.index)',
+                        metavar='DIR')
+    return parser.parse_args()
+
+
+# Main function entry point
+
+def main(args):
+    build_index(args.bedGraph, args.output or default_index_dir(args.bedGraph))
+
+
+if __name__ == '__main__':
+    main(get_args())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Confidence intervals and convergence checks for the sampled modes
+# of the read length and end bias profilers
+# Created: 2026-10-17
+# Depends: numpy
+
+from statistics import NormalDist
+import numpy as np
+
+MIN_SAMPLED_READS = 10000  # Never stop before this many reads are counted
+MIN_SAMPLED_TILES = 30  # Nor before this many tiles, when sampling tiles
+
+
+def z_score(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+# Wilson score interval for each bin's proportion of its row total. counts may
+# be 1-D or 2-D, where each row is a separate distribution.
+
+def wilson_interval(counts, confidence=0.95):
+    counts = np.asarray(counts, dtype=np.float64)
+    totals = counts.sum(axis=-1, keepdims=True)
+    z = z_score(confidence)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportion = counts / totals
+        denominator = 1 + z ** 2 / totals
+        center = (proportion + z ** 2 / (2 * totals)) / denominator
+        half_width = (z * np.sqrt(proportion * (1 - proportion) / totals +
+                                  z ** 2 / (4 * totals ** 2)) / denominator)
+    return proportion, center - half_width, center + half_width
+
+
+def has_converged(counts, tolerance, confidence=0.95):
+    counts = np.asarray(counts)
+    if counts.sum(axis=-1).min() < MIN_SAMPLED_READS:
+        return False
+    proportion, low, high = wilson_interval(counts, confidence)
+    return bool(np.all((high - low) / 2 <= tolerance))
+
+
+# Sampling whole tiles of the genome. Reads cluster within a tile, so the
+# reads are not independent draws. Each proportion is a ratio estimate (reads
+# of that kind over all reads, summed over the tiles), and its variance is
+# taken between tiles, with the finite population correction for drawing
+# n_tiles of total_tiles without replacement. Running sums keep each update
+# proportional to the number of bins, and sampling every tile gives a zero
+# width interval around the exact profile.
+
+class TileSample:
+    def __init__(self, n_bins, total_tiles):
+        self.total_tiles = total_tiles
+        self.n_tiles = 0
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.squares = np.zeros(n_bins, dtype=np.float64)
+        self.cross = np.zeros(n_bins, dtype=np.float64)
+        self.total_squares = 0.0
+
+    def add(self, tile_counts):
+        tile_total = float(tile_counts.sum())
+        self.n_tiles += 1
+        self.counts += tile_counts
+        self.squares += tile_counts.astype(np.float64) ** 2
+        self.cross += tile_counts * tile_total
+        self.total_squares += tile_total ** 2
+
+    def interval(self, confidence=0.95):
+        m = self.n_tiles
+        total = float(self.counts.sum())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proportion = self.counts / total
+            if m >= self.total_tiles:
+                half_width = np.zeros(len(self.counts))
+            elif m < 2:
+                half_width = np.full(len(self.counts), np.nan)
+            else:
+                residuals = (self.squares - 2 * proportion * self.cross +
+                             proportion ** 2 * self.total_squares)
+                variance = ((1 - m / self.total_tiles) * m / (m - 1) *
+                            np.maximum(residuals, 0) / total ** 2)
+                half_width = z_score(confidence) * np.sqrt(variance)
+        return (proportion, np.clip(proportion - half_width, 0, 1),
+                np.clip(proportion + half_width, 0, 1))
+
+    def has_converged(self, tolerance, confidence=0.95):
+        if self.n_tiles >= self.total_tiles:
+            return True
+        if (self.counts.sum() < MIN_SAMPLED_READS or
+                self.n_tiles < MIN_SAMPLED_TILES):
+            return False
+        proportion, low, high = self.interval(confidence)
+        return bool(np.all((high - low) / 2 <= tolerance))
+
+
+# Rows of label, count, proportion and confidence interval for output, from
+# Wilson intervals unless the interval is given. With no reads sampled there
+# is no proportion, and NA is reported.
+
+def interval_rows(labels, counts, confidence=0.95, interval=None):
+    if interval is None:
+        interval = wilson_interval(counts, confidence)
+    proportion, low, high = interval
+    for label, count, p, lo, hi in zip(labels, np.asarray(counts).tolist(),
+                                       proportion, low, high):
+        yield [label, count] + ['NA' if np.isnan(value) else '%.6f' % value
+                                for value in (p, lo, hi)]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: On-disk cache of full-range histograms for the read length tools,
+# so reruns with a different length window only slice the stored result
+# Created: 2026-10-17
+# Depends: numpy
+
+import json
+import numpy as np
+from hashlib import sha256
+from os import environ, getpid, listdir, makedirs, remove, replace, stat, utime
+from os.path import abspath, expanduser, join
+
+DEFAULT_CACHE_DIR = join(environ.get('XDG_CACHE_HOME', expanduser('~/.cache')),
+                         'sirens_profiles')
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3  # Bytes kept before the oldest are evicted
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def file_hash(input_file):
+    digest = sha256()
+    with open(input_file, 'rb') as input_handle:
+        for block in iter(lambda: input_handle.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Inputs are identified by path, size and modification time, or by a hash of
+# their contents when content_hash is set (slower, but survives copies and
+# touches)
+
+def input_fingerprint(input_file, content_hash=False):
+    if content_hash:
+        return {'sha256': file_hash(input_file)}
+    info = stat(input_file)
+    return {'path': abspath(input_file), 'size': info.st_size,
+            'mtime_ns': info.st_mtime_ns}
+
+
+def cache_key(tool, version, fingerprints, **params):
+    description = json.dumps({'tool': tool, 'version': version,
+                              'inputs': fingerprints, 'params': params},
+                             sort_keys=True)
+    return '%s.%s' % (tool, sha256(description.encode()).hexdigest()[:32])
+
+
+# Entries are .npz files in the cache directory. Reading an entry updates its
+# modification time, and after each write the least recently used entries are
+# removed until the directory is under max_size. An entry larger than max_size
+# on its own is not kept.
+
+class ResultCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        makedirs(cache_dir, exist_ok=True)
+
+    def entry_file(self, key):
+        return join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        entry_file = self.entry_file(key)
+        try:
+            with np.load(entry_file) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            return None
+        utime(entry_file)
+        return arrays
+
+    def store(self, key, **arrays):
+        entry_file = self.entry_file(key)
+        temp_file = '%s.%s.tmp.npz' % (entry_file[:-4], getpid())
+        np.savez_compressed(temp_file, **arrays)
+        if stat(temp_file).st_size > self.max_size:
+            remove(temp_file)
+            return
+        replace(temp_file, entry_file)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in listdir(self.cache_dir):
+            if name.endswith('.npz') and '.tmp.' not in name:
+                try:
+                    info = stat(join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime_ns, info.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                remove(join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
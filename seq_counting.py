@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Compact and bounded-memory sequence counting shared by fastq_unique_seqs.py and
+# bam_unique_seqs.py
+# Created: 2026-10-17
+# Depends: numpy
+
+import numpy as np
+from hashlib import blake2b
+from heapq import heapify, heappop, heappush, nlargest
+from operator import itemgetter
+from sys import stderr
+
+MAX_PACKED_LENGTH = 31  # 2 bits per base plus a leading 1 bit in a uint64
+CONSOLIDATE_SIZE = 1 << 22  # Pending keys held before they are merged
+BATCH_READS = 1 << 16  # Reads packed at once, bounds temporary arrays
+DECODE_BATCH = 1 << 18  # Keys unpacked at once when writing output
+
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for code, base in enumerate(b'ACGT'):
+    BASE_CODES[base] = code
+CODE_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+# Sum counts of repeated keys, returning sorted unique keys and their counts
+
+def sum_by_key(keys, counts):
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(inverse.ravel(), weights=counts,
+                                    minlength=len(unique_keys)).astype(np.int64)
+
+
+# Counts sequences as uint64 keys holding 2 bits per base behind a leading 1
+# bit, which keeps sequences of different lengths apart (AC is 0b10001, AAC is
+# 0b1000001). Sequences longer than MAX_PACKED_LENGTH or containing anything
+# other than A, C, G or T are counted in an ordinary dict. Batches of keys are
+# reduced with np.unique and merged into one sorted key/count array.
+
+class PackedSequenceCounter:
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = []
+        self.pending_size = 0
+        self.fallback = {}
+
+    def add_packed(self, keys, counts):
+        self.pending.append((keys, counts))
+        self.pending_size += len(keys)
+        if self.pending_size >= CONSOLIDATE_SIZE:
+            self.consolidate()
+
+    def consolidate(self):
+        if not self.pending:
+            return
+        keys = np.concatenate([self.keys] + [k for k, c in self.pending])
+        counts = np.concatenate([self.counts] + [c for k, c in self.pending])
+        self.keys, self.counts = sum_by_key(keys, counts)
+        self.pending = []
+        self.pending_size = 0
+
+    def add_fallback(self, sequence, count=1):
+        if sequence not in self.fallback:
+            self.fallback.update({sequence: 0})
+        self.fallback[sequence] += count
+
+    # Add reads given as concatenated sequence bytes (uint8 array) with the
+    # offset and length of each read
+
+    def add_sequences(self, data, offsets, lengths):
+        for first in range(0, len(lengths), BATCH_READS):
+            batch_offsets = offsets[first:first + BATCH_READS]
+            batch_lengths = lengths[first:first + BATCH_READS]
+            start = batch_offsets[0]
+            end = batch_offsets[-1] + batch_lengths[-1]
+            self.add_batch(data[start:end], batch_offsets - start,
+                           batch_lengths)
+
+    def add_batch(self, data, offsets, lengths):
+        codes = BASE_CODES[data]
+        read_index = np.repeat(np.arange(len(lengths)), lengths)
+        bad_bases = np.bincount(read_index[codes == 255],
+                                minlength=len(lengths))
+        packable = (bad_bases == 0) & (lengths <= MAX_PACKED_LENGTH)
+        base_packable = packable[read_index]
+        position = np.arange(len(data)) - offsets[read_index]
+        shifts = 2 * (lengths[read_index] - 1 - position)
+        values = (codes[base_packable].astype(np.uint64) <<
+                  shifts[base_packable].astype(np.uint64))
+        packed_lengths = lengths[packable]
+        keys = np.ones(len(packed_lengths), dtype=np.uint64) << (
+            2 * packed_lengths).astype(np.uint64)
+        nonempty = packed_lengths > 0
+        value_starts = np.cumsum(packed_lengths) - packed_lengths
+        if len(values):
+            keys[nonempty] |= np.bitwise_or.reduceat(values,
+                                                     value_starts[nonempty])
+        keys, counts = np.unique(keys, return_counts=True)
+        self.add_packed(keys, counts.astype(np.int64))
+        for i in np.flatnonzero(~packable).tolist():
+            start = offsets[i]
+            self.add_fallback(data[start:start + lengths[i]].tobytes().decode())
+
+    def add_strings(self, sequences):
+        packable = []
+        for sequence in sequences:
+            if sequence is None or len(sequence) > MAX_PACKED_LENGTH:
+                self.add_fallback(sequence)
+            else:
+                packable.append(sequence)
+        if not packable:
+            return
+        lengths = np.array([len(sequence) for sequence in packable],
+                           dtype=np.int64)
+        data = np.frombuffer(''.join(packable).encode(), dtype=np.uint8)
+        self.add_sequences(data, np.cumsum(lengths) - lengths, lengths)
+
+    def add(self, sequence):
+        self.add_strings([sequence])
+
+    def merge(self, other):
+        other.consolidate()
+        self.add_packed(other.keys, other.counts)
+        for sequence, count in other.fallback.items():
+            self.add_fallback(sequence, count)
+
+    def __len__(self):
+        self.consolidate()
+        return len(self.keys) + len(self.fallback)
+
+    # Unpack keys one length at a time. The leading 1 bit of a key of length L
+    # is bit 2L, so floor(log2(key) / 2) is L even where float64 rounds up.
+
+    def items(self):
+        self.consolidate()
+        for first in range(0, len(self.keys), DECODE_BATCH):
+            keys = self.keys[first:first + DECODE_BATCH]
+            counts = self.counts[first:first + DECODE_BATCH]
+            lengths = (np.log2(keys.astype(np.float64)) // 2).astype(np.int64)
+            for length in np.unique(lengths).tolist():
+                selected = lengths == length
+                if length == 0:
+                    sequences = [b''] * int(selected.sum())
+                else:
+                    shifts = 2 * np.arange(length - 1, -1, -1, dtype=np.uint64)
+                    codes = ((keys[selected, None] >> shifts) &
+                             np.uint64(3)).astype(np.uint8)
+                    sequences = CODE_BASES[codes].view(
+                        'S%d' % length).ravel().tolist()
+                for sequence, count in zip(sequences,
+                                           counts[selected].tolist()):
+                    yield sequence.decode(), count
+        for sequence, count in self.fallback.items():
+            yield sequence, count
+
+
+# HyperLogLog estimate of the number of distinct sequences. Packed keys are
+# hashed with splitmix64 and fallback sequences with blake2b, so estimates
+# from separate processes can be merged.
+
+def splitmix64(keys):
+    with np.errstate(over='ignore'):
+        z = keys + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def bit_length(values):
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class HyperLogLog:
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision - bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def add_keys(self, keys):
+        self.add_hashes(splitmix64(keys))
+
+    def add_strings(self, sequences):
+        self.add_hashes(np.array(
+            [int.from_bytes(blake2b(str(sequence).encode(),
+                                    digest_size=8).digest(), 'little')
+             for sequence in sequences], dtype=np.uint64))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * np.log(m / zeros)))  # Linear counting
+        return int(round(raw))
+
+
+# Space-Saving summary of the most abundant sequences, tracking at most
+# capacity sequences. A new sequence arriving when the table is full replaces
+# the least abundant one and inherits its count, so counts are overestimates
+# by at most the count they inherited (kept in errors). A lazy min-heap finds
+# the least abundant entry; stale heap entries are skipped and the heap is
+# rebuilt when it grows too large.
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+
+    def add(self, sequence, count=1):
+        if sequence in self.counts:
+            self.counts[sequence] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[sequence] = count
+            self.errors[sequence] = 0
+        else:
+            minimum, evicted = self.pop_minimum()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[sequence] = minimum + count
+            self.errors[sequence] = minimum
+        heappush(self.heap, (self.counts[sequence], sequence))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, sequence)
+                         for sequence, count in self.counts.items()]
+            heapify(self.heap)
+
+    def pop_minimum(self):
+        while True:
+            count, sequence = heappop(self.heap)
+            if self.counts.get(sequence) == count:
+                return count, sequence
+
+    def minimum(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    # Mergeable summaries: a sequence missing from a full table may have had
+    # up to that table's minimum count
+
+    def merge(self, other):
+        own_minimum = self.minimum()
+        other_minimum = other.minimum()
+        counts = {}
+        errors = {}
+        for sequence in set(self.counts) | set(other.counts):
+            counts[sequence] = (self.counts.get(sequence, own_minimum) +
+                                other.counts.get(sequence, other_minimum))
+            errors[sequence] = (self.errors.get(sequence, own_minimum) +
+                                other.errors.get(sequence, other_minimum))
+        kept = nlargest(self.capacity, counts.items(), key=itemgetter(1))
+        self.counts = dict(kept)
+        self.errors = {sequence: errors[sequence] for sequence, count in kept}
+        self.heap = [(count, sequence) for sequence, count in kept]
+        heapify(self.heap)
+
+    def top(self, n):
+        return nlargest(n, self.counts.items(), key=itemgetter(1))
+
+
+# Bounded-memory counter for the top_n most abundant sequences plus an
+# estimate of how many distinct sequences were seen. Each batch of reads is
+# counted exactly with a PackedSequenceCounter first, so the Space-Saving
+# table and the HyperLogLog see each distinct sequence once per batch.
+
+class TopSequenceCounter:
+    def __init__(self, top_n, capacity, precision=14):
+        self.top_n = top_n
+        self.summary = SpaceSaving(max(capacity, top_n))
+        self.distinct = HyperLogLog(precision)
+
+    def add_batch_counter(self, batch_counter):
+        batch_counter.consolidate()
+        self.distinct.add_keys(batch_counter.keys)
+        self.distinct.add_strings(batch_counter.fallback)
+        for sequence, count in batch_counter.items():
+            self.summary.add(sequence, count)
+
+    def add_sequences(self, data, offsets, lengths):
+        for first in range(0, len(lengths), BATCH_READS):
+            batch_counter = PackedSequenceCounter()
+            batch_counter.add_sequences(data, offsets[first:first + BATCH_READS],
+                                        lengths[first:first + BATCH_READS])
+            self.add_batch_counter(batch_counter)
+
+    def add_strings(self, sequences):
+        batch_counter = PackedSequenceCounter()
+        batch_counter.add_strings(sequences)
+        self.add_batch_counter(batch_counter)
+
+    def add(self, sequence):
+        self.add_strings([sequence])
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.distinct.merge(other.distinct)
+
+    def distinct_estimate(self):
+        return self.distinct.estimate()
+
+    def max_error(self):
+        return max([self.summary.errors[sequence]
+                    for sequence, count in self.summary.top(self.top_n)] or [0])
+
+    def items(self):
+        return iter(self.summary.top(self.top_n))
+
+
+# Accuracy notes for a top-N count, to stderr
+
+def report_top_counter(top_counter):
+    print('Estimated distinct sequences: %s' % top_counter.distinct_estimate(),
+          file=stderr)
+    print('Largest possible overcount in reported sequences: %s' %
+          top_counter.max_error(), file=stderr)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Author: Jeffrey Grover
+# Purpose: Regression tests for whitespace-delimited input to bedgraph_io
+# Created: 2026-10-17
+# Depends: numpy, pytest
+
+import sys
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from bed_sort import sort_bed
+from bedgraph_io import BedGraphChunk, bedgraph_chrom_totals, sum_totals
+from bedgraph_methylation_by_bed import read_features, sum_methylation
+
+
+def test_space_and_tab_separated_columns():
+    chunk = BedGraphChunk(b'track type=bedGraph\nchr1 0 1 50 1 1\n'
+                          b'chr1  5\t6 100 2 0 \r\n\n   \nchr2\t3\t4\t0\t0\t3\n')
+    assert len(chunk) == 3
+    assert chunk.column(1).tolist() == [0, 5, 3]
+    assert chunk.column(5).tolist() == [1, 0, 3]
+    assert [name for name, first, last in chunk.chrom_runs()] == ['chr1',
+                                                                 'chr2']
+
+
+def test_space_delimited_totals(tmp_path):
+    bedgraph = tmp_path / 'spaces.bedGraph'
+    bedgraph.write_text('track type=bedGraph\nchr1 0 1 50 1 1\n'
+                        'chr1 5 6 100 2 0\nchr2 3 4 0 0 3\n')
+    assert sum_totals(bedgraph_chrom_totals(str(bedgraph))) == (3, 4)
+
+
+def test_space_delimited_bed_sort(tmp_path):
+    bed = tmp_path / 'spaces.bed'
+    bed.write_text('chr2 5 9 a\nchr1 0 3 b\n')
+    output = sort_bed(str(bed), str(tmp_path / 'sorted.bed'))
+    with open(output) as input_handle:
+        assert input_handle.read() == 'chr1 0 3 b\nchr2 5 9 a\n'
+
+
+def test_space_delimited_feature_sums(tmp_path):
+    bedgraph = tmp_path / 'spaces.bedGraph'
+    bedgraph.write_text('track type=bedGraph\nchr1 0 1 50 1 1\n'
+                        'chr1 5 6 100 2 0\nchr2 3 4 0 0 3\n')
+    bed = tmp_path / 'features.bed'
+    bed.write_text('chr2 0 10 f2\nchr1 0 10 f1\nchr1 1 5 f3\n')
+    features = read_features(str(bed))
+    assert [entry[3] for entry in features] == ['f1', 'f3', 'f2']
+    assert sum_methylation(str(bedgraph), features).tolist() == [[3, 1],
+                                                                [0, 0],
+                                                                [0, 3]]
+
+
+def test_missing_column():
+    chunk = BedGraphChunk(b'chr1 0 1\n')
+    try:
+        chunk.column(4)
+    except ValueError as error:
+        assert 'fewer than 5 columns' in str(error)
+    else:
+        raise AssertionError('Missing column not reported')